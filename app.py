@@ -3,21 +3,41 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+from matplotlib import colormaps
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
 from pathlib import Path
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.enum.text import PP_ALIGN, MSO_ANCHOR
 from pptx.enum.shapes import MSO_SHAPE
 import io
+import functools
+import hashlib
 import tempfile
 import os
 import arabic_reshaper
-
-# Set page config
-st.set_page_config(page_title="إحصائيات التلاميذ", layout="wide")
-
-# Apply RTL (Right-to-Left) styling for Arabic
-st.markdown("""
+from concurrent.futures import ThreadPoolExecutor
+
+# Numba is optional: the JIT kernels below fall back to pandas/numpy when it is not installed
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# python-calamine is optional too: it parses workbooks much faster than openpyxl, and without it
+# pandas keeps picking its default engine for the file type
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
+
+# RTL (Right-to-Left) styling for Arabic, whitespace-collapsed to keep the per-rerun payload small.
+# It is emitted on every run on purpose: Streamlit drops any element a rerun does not re-emit.
+RTL_CSS = " ".join("""
 <style>
     /* Main container RTL */
     .main .block-container {
@@ -108,11 +128,18 @@ st.markdown("""
         text-align: right !important;
     }
 </style>
-""", unsafe_allow_html=True)
+""".split())
+
+# Set page config
+st.set_page_config(page_title="إحصائيات التلاميذ", layout="wide")
+
+# Apply RTL styling for Arabic
+st.markdown(RTL_CSS, unsafe_allow_html=True)
 
 # ============ ARABIC TEXT FIXER ============
+@functools.lru_cache(maxsize=1024)
 def fix_arabic(text):
-    """Reshape and reorder Arabic text for correct rendering in Plotly/Charts"""
+    """Reshape and reorder Arabic text for correct rendering in Plotly/Charts (memoized: labels repeat across slides)"""
     if not text or not isinstance(text, str):
         return text
     try:
@@ -135,12 +162,15 @@ ACCENT_COLOR = RGBColor(255, 192, 0)      # Gold
 DARK_COLOR = RGBColor(44, 62, 80)         # Dark blue-gray
 LIGHT_COLOR = RGBColor(236, 240, 241)     # Light gray
 
+# Clark-notation name of the paragraph direction attribute, resolved once
+RTL_TAG = qn('a:rtl')
+
 def set_rtl(text_frame):
     """Set Right-to-Left direction on text frame for Arabic"""
     try:
         for paragraph in text_frame.paragraphs:
             pPr = paragraph._p.get_or_add_pPr()
-            pPr.set(qn('a:rtl'), '1')
+            pPr.set(RTL_TAG, '1')
     except Exception:
         pass
 
@@ -148,10 +178,49 @@ def set_paragraph_rtl(paragraph):
     """Set Right-to-Left direction on a paragraph"""
     try:
         pPr = paragraph._p.get_or_add_pPr()
-        pPr.set(qn('a:rtl'), '1')
+        pPr.set(RTL_TAG, '1')
     except Exception:
         pass
 
+def add_rtl_paragraph(text_frame, text, size, bold=False, color=None, align=PP_ALIGN.RIGHT, space_after=None):
+    """Append a right-to-left paragraph; alignment and direction share one pPr lookup"""
+    p = text_frame.add_paragraph()
+    p.text = text
+    font = p.font
+    font.size = size
+    if bold:
+        font.bold = True
+    if color is not None:
+        font.color.rgb = color
+    if space_after is not None:
+        p.space_after = space_after
+    pPr = p._p.get_or_add_pPr()
+    pPr.algn = align
+    pPr.set(RTL_TAG, '1')
+    return p
+
+def add_rtl_lines(text_frame, lines, size, space_after=None):
+    """Append one right-to-left paragraph per line"""
+    for line in lines:
+        add_rtl_paragraph(text_frame, line, size, space_after=space_after)
+
+def add_text(slide, left, top, width, height, text, size, bold=False, color=None, align=PP_ALIGN.CENTER, rtl=True):
+    """Add a single-paragraph text box and style it in one pass; lengths are EMU, returns the text frame"""
+    text_frame = slide.shapes.add_textbox(left, top, width, height).text_frame
+    p = text_frame.paragraphs[0]
+    p.text = text
+    font = p.font
+    font.size = size
+    if bold:
+        font.bold = True
+    if color is not None:
+        font.color.rgb = color
+    pPr = p._p.get_or_add_pPr()
+    pPr.algn = align
+    if rtl:
+        pPr.set(RTL_TAG, '1')
+    return text_frame
+
 def add_gradient_background(slide, color1, color2, angle=90):
     """Add gradient background to slide"""
     try:
@@ -185,24 +254,9 @@ def add_title_slide(prs, title, subtitle=""):
     top_bar.fill.solid()
     top_bar.fill.fore_color.rgb = ACCENT_COLOR
     top_bar.line.fill.background()
-    title_box = slide.shapes.add_textbox(Inches(0.5), Inches(2.3), Inches(12.333), Inches(1.5))
-    title_frame = title_box.text_frame
-    title_para = title_frame.paragraphs[0]
-    title_para.text = title
-    title_para.font.size = Pt(48)
-    title_para.font.bold = True
-    title_para.font.color.rgb = RGBColor(255, 255, 255)
-    title_para.alignment = PP_ALIGN.CENTER
-    set_paragraph_rtl(title_para)
+    add_text(slide, Inches(0.5), Inches(2.3), Inches(12.333), Inches(1.5), title, Pt(48), bold=True, color=RGBColor(255, 255, 255))
     if subtitle:
-        subtitle_box = slide.shapes.add_textbox(Inches(0.5), Inches(4.2), Inches(12.333), Inches(1))
-        sub_frame = subtitle_box.text_frame
-        sub_para = sub_frame.paragraphs[0]
-        sub_para.text = subtitle
-        sub_para.font.size = Pt(24)
-        sub_para.font.color.rgb = RGBColor(200, 220, 240)
-        sub_para.alignment = PP_ALIGN.CENTER
-        set_paragraph_rtl(sub_para)
+        add_text(slide, Inches(0.5), Inches(4.2), Inches(12.333), Inches(1), subtitle, Pt(24), color=RGBColor(200, 220, 240))
     bottom_line = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, Inches(4), Inches(5.5), Inches(5.333), Inches(0.05))
     bottom_line.fill.solid()
     bottom_line.fill.fore_color.rgb = ACCENT_COLOR
@@ -221,15 +275,7 @@ def add_content_slide(prs, title, slide_num=None):
     accent_stripe.fill.solid()
     accent_stripe.fill.fore_color.rgb = ACCENT_COLOR
     accent_stripe.line.fill.background()
-    title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.25), Inches(12.333), Inches(0.8))
-    title_frame = title_box.text_frame
-    title_para = title_frame.paragraphs[0]
-    title_para.text = title
-    title_para.font.size = Pt(32)
-    title_para.font.bold = True
-    title_para.font.color.rgb = RGBColor(255, 255, 255)
-    title_para.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(title_para)
+    add_text(slide, Inches(0.5), Inches(0.25), Inches(12.333), Inches(0.8), title, Pt(32), bold=True, color=RGBColor(255, 255, 255), align=PP_ALIGN.RIGHT)
     corner_shape = slide.shapes.add_shape(MSO_SHAPE.RIGHT_TRIANGLE, Inches(0), Inches(6), Inches(1.333), Inches(1.5))
     corner_shape.fill.solid()
     corner_shape.fill.fore_color.rgb = PRIMARY_COLOR
@@ -240,37 +286,204 @@ def add_content_slide(prs, title, slide_num=None):
         num_circle.fill.solid()
         num_circle.fill.fore_color.rgb = PRIMARY_COLOR
         num_circle.line.fill.background()
-        num_txt = slide.shapes.add_textbox(Inches(12.4), Inches(6.92), Inches(0.6), Inches(0.45))
-        ntf = num_txt.text_frame
-        np = ntf.paragraphs[0]
-        np.text = str(slide_num)
-        np.font.size = Pt(16)
-        np.font.bold = True
-        np.font.color.rgb = RGBColor(255, 255, 255)
-        np.alignment = PP_ALIGN.CENTER
+        add_text(slide, Inches(12.4), Inches(6.92), Inches(0.6), Inches(0.45), str(slide_num), Pt(16), bold=True, color=RGBColor(255, 255, 255), rtl=False)
     return slide
 
-@st.cache_resource
-def check_kaleido_available():
-    try:
-        import kaleido
-        test_fig = go.Figure()
-        test_fig.to_image(format="png", width=100, height=100)
-        return True
-    except Exception:
-        return False
+# Pixels per slide inch when a 13.333in slide fills a 1920px-wide screen
+SLIDE_PPI = 144
+# Upper bound on the matplotlib raster density, the resolution every chart used to get
+MAX_CHART_DPI = 150
 
-KALEIDO_AVAILABLE = check_kaleido_available()
+def chart_dpi(fig, width):
+    """DPI that rasterizes a matplotlib chart at the pixel width of its slide placement"""
+    return min(MAX_CHART_DPI, SLIDE_PPI * width.inches / fig.get_figwidth())
 
-def fig_to_image(fig):
-    if not KALEIDO_AVAILABLE:
-        return None
+def fig_to_image(fig, dpi=MAX_CHART_DPI):
+    # matplotlib rasterizes in-process
     try:
-        img_bytes = fig.to_image(format="png", width=900, height=500, scale=2)
-        return io.BytesIO(img_bytes)
+        img_stream = io.BytesIO()
+        fig.savefig(img_stream, format="png", dpi=dpi)
+        img_stream.seek(0)
+        return img_stream
     except Exception:
         return None
 
+# Slide chart labels, reshaped once at import instead of on every deck build
+PIE_LABELS = [fix_arabic('دون المعدل\n(0-9.99)'), fix_arabic('متوسط\n(10-11.99)'), fix_arabic('جيد/ممتاز\n(12-20)')]
+LABEL_STUDENT = fix_arabic('تلميذ')
+LABEL_MEAN = fix_arabic('المتوسط')
+LABEL_MEDIAN = fix_arabic('الوسيط')
+LABEL_PASS_LINE = fix_arabic('حد النجاح (10)')
+LABEL_GRADE = fix_arabic('المعدل')
+LABEL_STUDENT_COUNT = fix_arabic('عدد التلاميذ')
+LABEL_SUBJECT = fix_arabic('المادة')
+LABEL_LANGUAGE = fix_arabic('اللغة')
+LABEL_FIELD = fix_arabic('المجال')
+LABEL_GAP = fix_arabic('الفجوة')
+LABEL_PASS_RATE_PCT = fix_arabic('نسبة النجاح %')
+LABEL_PASS_LIMIT = fix_arabic('حد النجاح')
+LABEL_FAILURE_RATE = fix_arabic('نسبة الرسوب')
+LABEL_DANGER_LINE = fix_arabic('خط الخطر')
+LABEL_SCORE = fix_arabic('التقدير')
+LABEL_BALANCE = fix_arabic('توازن')
+LABEL_GAP_DISTRIBUTION = fix_arabic('توزيع الفجوة اللغوية')
+LABEL_CORRELATION = fix_arabic('الارتباط')
+LABEL_LANGUAGE_PASS_TITLE = fix_arabic('نسبة النجاح في كل لغة (≥10)')
+LANGUAGE_LABELS = [fix_arabic('العربية'), fix_arabic('الفرنسية'), fix_arabic('الإنجليزية')]
+FIELD_COLORS = {fix_arabic('المواد العلمية'): '#636EFA', fix_arabic('المواد الأدبية'): '#EF553B'}
+LANGUAGE_TYPE_COLORS = {fix_arabic('اللغة الأم'): '#00CC96', fix_arabic('لغة أجنبية'): '#EF553B'}
+
+def pie_figure_mpl(labels, values, colors, total):
+    """Donut chart of the grade brackets for the slides, in the 9x5 frame shared by the slide charts;
+    None when no student has an average, since ax.pie cannot draw all-zero wedges"""
+    value_sum = sum(values)
+    if value_sum == 0:
+        return None
+    fig = Figure(figsize=(9, 5), layout="constrained")
+    ax = fig.add_subplot()
+    wedges, _, _ = ax.pie(
+        values, colors=colors, explode=[0.05, 0.02, 0.02], startangle=45, counterclock=False,
+        autopct=lambda pct: f"{round(pct * value_sum / 100)}\n{pct:.1f}%" if pct > 0 else "",
+        pctdistance=0.82, wedgeprops=dict(width=0.35, edgecolor="white", linewidth=3),
+        textprops=dict(color="white", fontsize=14, fontweight="bold")
+    )
+    ax.text(0, 0, f"{total}\n{LABEL_STUDENT}", ha="center", va="center", fontsize=18, fontweight="bold", color="#333")
+    ax.legend(wedges, labels, loc="center left", bbox_to_anchor=(1.0, 0.5), frameon=False, fontsize=13)
+    ax.set_aspect("equal")
+    return fig
+
+def hist_figure_mpl(grades, grade_mean, grade_median):
+    """Grade histogram with mean/median/pass lines for the slides"""
+    fig = Figure(figsize=(9, 5), layout="constrained")
+    ax = fig.add_subplot()
+    ax.hist(grades, bins=20, color=(99/255, 110/255, 250/255, 0.7), edgecolor=(99/255, 110/255, 250/255, 1), linewidth=1)
+    ax.axvline(grade_mean, color="red", linestyle="--", linewidth=2, label=f"{LABEL_MEAN}: {grade_mean:.2f}")
+    ax.axvline(grade_median, color="green", linestyle=":", linewidth=2, label=f"{LABEL_MEDIAN}: {grade_median:.2f}")
+    ax.axvline(10, color="orange", linestyle="-", linewidth=2, label=LABEL_PASS_LINE)
+    ax.set_xlabel(LABEL_GRADE, fontsize=13)
+    ax.set_ylabel(LABEL_STUDENT_COUNT, fontsize=13)
+    ax.legend(loc="upper left", fontsize=11)
+    ax.grid(axis="y", alpha=0.3)
+    return fig
+
+def scale_colors(values, cmap_name):
+    """Color values across their own range, as Plotly's continuous color scales do"""
+    values = np.asarray(values, dtype=np.float64)
+    lo, hi = np.nanmin(values), np.nanmax(values)
+    positions = Normalize(lo, hi)(values) if hi > lo else np.full(len(values), 0.5)
+    return colormaps[cmap_name](positions)
+
+def bar_figure_mpl(labels, values, colors, value_fmt="{:.2f}", xlabel="", ylabel="", title=None,
+                   hline=None, hline_color="green", hline_label=None, legend=None):
+    """Vertical bars with their values on top and an optional reference line for the slides"""
+    fig = Figure(figsize=(9, 5), layout="constrained")
+    ax = fig.add_subplot()
+    bars = ax.bar(range(len(labels)), values, color=colors)
+    ax.bar_label(bars, labels=[value_fmt.format(v) for v in values], padding=3, fontsize=12)
+    if len(labels) > 6:
+        ax.set_xticks(range(len(labels)), labels, rotation=45, ha="right", fontsize=11)
+    else:
+        ax.set_xticks(range(len(labels)), labels, fontsize=13)
+    if hline is not None:
+        ax.axhline(hline, color=hline_color, linestyle="--", linewidth=2)
+        if hline_label:
+            ax.text(1.01, hline, hline_label, transform=ax.get_yaxis_transform(), ha="left", va="center", color=hline_color, fontsize=11)
+    if legend:
+        ax.legend(handles=[Patch(color=color, label=label) for label, color in legend.items()],
+                  loc="center left", bbox_to_anchor=(1.0, 0.5), frameon=False, fontsize=12)
+    ax.set_xlabel(xlabel, fontsize=13)
+    ax.set_ylabel(ylabel, fontsize=13)
+    if title:
+        ax.set_title(title, fontsize=15)
+    # Headroom for the value labels above the tallest bar
+    ax.margins(y=0.12)
+    ax.grid(axis="y", alpha=0.3)
+    ax.set_axisbelow(True)
+    return fig
+
+def subject_means_figure_mpl(labels, means, colors):
+    """Horizontal bars of the subject averages on the 0-20 scale with the pass line"""
+    fig = Figure(figsize=(9, 5), layout="constrained")
+    ax = fig.add_subplot()
+    bars = ax.barh(range(len(labels)), means, color=colors, edgecolor="white")
+    ax.bar_label(bars, labels=[f"{v:.2f}" for v in means], padding=3, fontsize=11)
+    ax.set_yticks(range(len(labels)), labels, fontsize=11)
+    ax.axvline(10, color="orange", linestyle="--", linewidth=2)
+    ax.text(10, 1.01, LABEL_PASS_LIMIT, transform=ax.get_xaxis_transform(), ha="center", va="bottom", color="orange", fontsize=11)
+    ax.set_xlim(0, 20)
+    ax.set_xlabel(LABEL_MEAN, fontsize=13)
+    ax.grid(axis="x", alpha=0.3)
+    ax.set_axisbelow(True)
+    return fig
+
+def box_figure_mpl(labels, groups):
+    """One box per subject in the Set2 palette for the slides"""
+    fig = Figure(figsize=(9, 5), layout="constrained")
+    ax = fig.add_subplot()
+    box = ax.boxplot(groups, patch_artist=True, medianprops=dict(color="#333", linewidth=2),
+                     flierprops=dict(marker="o", markersize=4, alpha=0.6))
+    palette = colormaps["Set2"].colors
+    for i, patch in enumerate(box["boxes"]):
+        patch.set_facecolor(palette[i % len(palette)])
+    ax.set_xticks(range(1, len(labels) + 1), labels, rotation=45, ha="right", fontsize=11)
+    ax.set_xlabel(LABEL_SUBJECT, fontsize=13)
+    ax.set_ylabel(LABEL_SCORE, fontsize=13)
+    ax.grid(axis="y", alpha=0.3)
+    ax.set_axisbelow(True)
+    return fig
+
+def gap_hist_figure_mpl(gaps):
+    """Distribution of the Arabic minus foreign-language gap around the balance line"""
+    fig = Figure(figsize=(9, 5), layout="constrained")
+    ax = fig.add_subplot()
+    counts, _, _ = ax.hist(gaps, bins=20, color="#636EFA", edgecolor="white")
+    # Headroom for the balance label above the tallest bin
+    ax.set_ylim(0, counts.max() * 1.12)
+    ax.axvline(0, color="red", linestyle="--", linewidth=2)
+    ax.text(0, 0.98, f" {LABEL_BALANCE}", transform=ax.get_xaxis_transform(), ha="left", va="top", color="red", fontsize=11)
+    ax.set_title(LABEL_GAP_DISTRIBUTION, fontsize=15)
+    ax.set_xlabel(LABEL_GAP, fontsize=13)
+    ax.set_ylabel(LABEL_STUDENT_COUNT, fontsize=13)
+    ax.grid(axis="y", alpha=0.3)
+    ax.set_axisbelow(True)
+    return fig
+
+def corr_heatmap_figure_mpl(corr_values, labels):
+    """Annotated correlation matrix on a fixed -1..1 diverging scale"""
+    fig = Figure(figsize=(9, 5), layout="constrained")
+    ax = fig.add_subplot()
+    im = ax.imshow(corr_values, cmap="RdBu_r", vmin=-1, vmax=1, aspect="auto")
+    for (i, j), value in np.ndenumerate(corr_values):
+        if not np.isnan(value):
+            ax.text(j, i, f"{value:.2f}", ha="center", va="center", fontsize=8, color="white" if abs(value) > 0.6 else "black")
+    ax.set_xticks(range(len(labels)), labels, rotation=45, ha="right", fontsize=9)
+    ax.set_yticks(range(len(labels)), labels, fontsize=9)
+    ax.set_xlabel(LABEL_SUBJECT, fontsize=12)
+    ax.set_ylabel(LABEL_SUBJECT, fontsize=12)
+    fig.colorbar(im, ax=ax, label=LABEL_CORRELATION)
+    return fig
+
+def add_chart_images(chart_jobs, max_workers=4):
+    """Render queued (slide, fig, position) charts concurrently, then place them in order;
+    a chart whose figure is None has no data and is left off its slide"""
+    chart_jobs = [job for job in chart_jobs if job[1] is not None]
+    if not chart_jobs:
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chart_jobs))) as executor:
+        # Charts placed narrower than their figure are rendered with fewer pixels to draw and compress
+        img_streams = list(executor.map(fig_to_image, [fig for _, fig, _ in chart_jobs],
+                                        [chart_dpi(fig, width) for _, fig, (_, _, width) in chart_jobs]))
+    for (slide, _, (left, top, width)), img_stream in zip(chart_jobs, img_streams):
+        if img_stream:
+            slide.shapes.add_picture(img_stream, left, top, width=width)
+
+def new_presentation():
+    """Create an empty 16:9 presentation"""
+    prs = Presentation()
+    prs.slide_width = Inches(13.333)
+    prs.slide_height = Inches(7.5)
+    return prs
+
 def add_toc_slide(prs):
     slide_layout = prs.slide_layouts[6]
     slide = prs.slides.add_slide(slide_layout)
@@ -283,15 +496,7 @@ def add_toc_slide(prs):
     title_bg.fill.solid()
     title_bg.fill.fore_color.rgb = PRIMARY_COLOR
     title_bg.line.fill.background()
-    title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.4), Inches(12.333), Inches(0.8))
-    title_frame = title_box.text_frame
-    title_para = title_frame.paragraphs[0]
-    title_para.text = "📋 فهرس المحتويات"
-    title_para.font.size = Pt(36)
-    title_para.font.bold = True
-    title_para.font.color.rgb = RGBColor(255, 255, 255)
-    title_para.alignment = PP_ALIGN.CENTER
-    set_paragraph_rtl(title_para)
+    add_text(slide, Inches(0.5), Inches(0.4), Inches(12.333), Inches(0.8), "📋 فهرس المحتويات", Pt(36), bold=True, color=RGBColor(255, 255, 255))
     toc_items = [
         ("1", "📈 الإحصائيات العامة", PRIMARY_COLOR),
         ("2", "📊 توزيع شرائح المعدلات", SECONDARY_COLOR),
@@ -311,68 +516,50 @@ def add_toc_slide(prs):
             x_pos, y_pos = 7.0, y_start + (i * 0.45)
         else:
             x_pos, y_pos = 0.8, y_start + ((i - 6) * 0.45)
-        item_box = slide.shapes.add_textbox(Inches(x_pos), Inches(y_pos + 0.05), Inches(5.0), Inches(0.4))
-        item_para = item_box.text_frame.paragraphs[0]
-        item_para.text = text
-        item_para.font.size = Pt(18)
-        item_para.alignment = PP_ALIGN.RIGHT
-        set_paragraph_rtl(item_para)
+        add_text(slide, Inches(x_pos), Inches(y_pos + 0.05), Inches(5.0), Inches(0.4), text, Pt(18), align=PP_ALIGN.RIGHT)
         circle = slide.shapes.add_shape(MSO_SHAPE.OVAL, Inches(x_pos + 5.1), Inches(y_pos), Inches(0.4), Inches(0.4))
         circle.fill.solid()
         circle.fill.fore_color.rgb = color
         circle.line.fill.background()
-        num_box = slide.shapes.add_textbox(Inches(x_pos + 5.1), Inches(y_pos + 0.05), Inches(0.4), Inches(0.35))
-        num_para = num_box.text_frame.paragraphs[0]
-        num_para.text = num
-        num_para.font.size = Pt(14)
-        num_para.font.bold = True
-        num_para.font.color.rgb = RGBColor(255, 255, 255)
-        num_para.alignment = PP_ALIGN.CENTER
+        add_text(slide, Inches(x_pos + 5.1), Inches(y_pos + 0.05), Inches(0.4), Inches(0.35), num, Pt(14), bold=True, color=RGBColor(255, 255, 255), rtl=False)
     bottom_shape = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, Inches(2), Inches(6.8), Inches(9.333), Inches(0.05))
     bottom_shape.fill.solid()
     bottom_shape.fill.fore_color.rgb = ACCENT_COLOR
     bottom_shape.line.fill.background()
     return slide
 
-def add_stat_card(slide, x, y, width, height, title, value, icon, bg_color, text_color=RGBColor(255,255,255)):
-    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(x), Inches(y), Inches(width), Inches(height))
+# Border widths and colors shared by the card helpers
+CARD_BORDER = Pt(2)
+QUARTILE_BORDER = Pt(1.5)
+WHITE = RGBColor(255, 255, 255)
+MUTED_TEXT = RGBColor(100, 100, 100)
+BODY_TEXT = RGBColor(55, 65, 81)
+# (background, border) pairs shared by the subject insight cards
+CARD_GREEN = (RGBColor(220, 252, 231), RGBColor(22, 163, 74))
+CARD_RED = (RGBColor(254, 226, 226), RGBColor(220, 38, 38))
+CARD_BLUE = (RGBColor(219, 234, 254), RGBColor(37, 99, 235))
+CARD_YELLOW = (RGBColor(254, 249, 195), RGBColor(202, 138, 4))
+
+def add_stat_card(slide, x, y, width, height, title, value, icon, bg_color, text_color=WHITE):
+    left, top, w = Inches(x), Inches(y), Inches(width)
+    inner_w = w - Inches(0.2)
+    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, w, Inches(height))
     card.fill.solid()
     card.fill.fore_color.rgb = bg_color
     card.line.fill.background()
-    icon_box = slide.shapes.add_textbox(Inches(x + 1), Inches(y + 0.15), Inches(width - 0.2), Inches(0.5))
-    icon_para = icon_box.text_frame.paragraphs[0]
-    icon_para.text = icon
-    icon_para.font.size = Pt(28)
-    icon_para.alignment = PP_ALIGN.CENTER
-    value_box = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.6), Inches(width - 0.2), Inches(0.6))
-    value_para = value_box.text_frame.paragraphs[0]
-    value_para.text = str(value)
-    value_para.font.size = Pt(32)
-    value_para.font.bold = True
-    value_para.font.color.rgb = text_color
-    value_para.alignment = PP_ALIGN.CENTER
-    title_box = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 1.15), Inches(width - 0.2), Inches(0.4))
-    title_para = title_box.text_frame.paragraphs[0]
-    title_para.text = title
-    title_para.font.size = Pt(14)
-    title_para.font.color.rgb = RGBColor(240, 240, 240)
-    title_para.alignment = PP_ALIGN.CENTER
-    set_paragraph_rtl(title_para)
+    add_text(slide, left + Inches(1), top + Inches(0.15), inner_w, Inches(0.5), icon, Pt(28), rtl=False)
+    add_text(slide, left + Inches(0.1), top + Inches(0.6), inner_w, Inches(0.6), str(value), Pt(32), bold=True, color=text_color, rtl=False)
+    add_text(slide, left + Inches(0.1), top + Inches(1.15), inner_w, Inches(0.4), title, Pt(14), color=RGBColor(240, 240, 240))
 
 def add_bracket_card(slide, x, y, width, height, emoji, title, count, pct, bg_color, border_color):
-    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(x), Inches(y), Inches(width), Inches(height))
+    left, top, w, h = Inches(x), Inches(y), Inches(width), Inches(height)
+    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, w, h)
     card.fill.solid()
     card.fill.fore_color.rgb = bg_color
     card.line.color.rgb = border_color
-    card.line.width = Pt(2)
-    tf = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.1), Inches(width - 0.2), Inches(height - 0.2)).text_frame
+    card.line.width = CARD_BORDER
+    tf = add_text(slide, left + Inches(0.1), top + Inches(0.1), w - Inches(0.2), h - Inches(0.2), f"{emoji} {title}", Pt(14), bold=True, color=border_color, rtl=False)
     tf.word_wrap = True
-    p1 = tf.paragraphs[0]
-    p1.text = f"{emoji} {title}"
-    p1.font.size = Pt(14)
-    p1.font.bold = True
-    p1.font.color.rgb = border_color
-    p1.alignment = PP_ALIGN.CENTER
     p2 = tf.add_paragraph()
     p2.text = f"{count} تلميذ"
     p2.font.size = Pt(24)
@@ -386,109 +573,141 @@ def add_bracket_card(slide, x, y, width, height, emoji, title, count, pct, bg_co
     p3.alignment = PP_ALIGN.CENTER
 
 def add_fancy_stat(slide, x, y, icon, label, value, bg_color, text_color, width=2.95):
-    box = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(x), Inches(y), Inches(width), Inches(0.65))
+    left, top, w = Inches(x), Inches(y), Inches(width)
+    box = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, w, Inches(0.65))
     box.fill.solid()
     box.fill.fore_color.rgb = bg_color
     box.line.color.rgb = text_color
-    box.line.width = Pt(2)
-    p = slide.shapes.add_textbox(Inches(x + 0.05), Inches(y + 0.05), Inches(width - 0.1), Inches(0.3)).text_frame.paragraphs[0]
-    p.text = f"{icon} {label}"
-    p.font.size = Pt(11)
-    p.font.color.rgb = RGBColor(100, 100, 100)
-    p.alignment = PP_ALIGN.CENTER
-    vp = slide.shapes.add_textbox(Inches(x + 0.05), Inches(y + 0.32), Inches(width - 0.1), Inches(0.3)).text_frame.paragraphs[0]
-    vp.text = value
-    vp.font.size = Pt(18)
-    vp.font.bold = True
-    vp.font.color.rgb = text_color
-    vp.alignment = PP_ALIGN.CENTER
+    box.line.width = CARD_BORDER
+    add_text(slide, left + Inches(0.05), top + Inches(0.05), w - Inches(0.1), Inches(0.3), f"{icon} {label}", Pt(11), color=MUTED_TEXT, rtl=False)
+    add_text(slide, left + Inches(0.05), top + Inches(0.32), w - Inches(0.1), Inches(0.3), value, Pt(18), bold=True, color=text_color, rtl=False)
 
 def add_quartile_card(slide, x, y, label, value, color):
-    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(x), Inches(y), Inches(1.95), Inches(0.75))
+    left, top = Inches(x), Inches(y)
+    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, Inches(1.95), Inches(0.75))
     card.fill.solid()
     card.fill.fore_color.rgb = RGBColor(250, 250, 250)
     card.line.color.rgb = color
-    card.line.width = Pt(1.5)
-    lp = slide.shapes.add_textbox(Inches(x + 0.05), Inches(y + 0.08), Inches(1.85), Inches(0.3)).text_frame.paragraphs[0]
-    lp.text = label
-    lp.font.size = Pt(10)
-    lp.font.color.rgb = RGBColor(100, 100, 100)
-    lp.alignment = PP_ALIGN.CENTER
-    vp = slide.shapes.add_textbox(Inches(x + 0.05), Inches(y + 0.38), Inches(1.85), Inches(0.3)).text_frame.paragraphs[0]
-    vp.text = f"{value:.2f}"
-    vp.font.size = Pt(16)
-    vp.font.bold = True
-    vp.font.color.rgb = color
-    vp.alignment = PP_ALIGN.CENTER
+    card.line.width = QUARTILE_BORDER
+    add_text(slide, left + Inches(0.05), top + Inches(0.08), Inches(1.85), Inches(0.3), label, Pt(10), color=MUTED_TEXT, rtl=False)
+    add_text(slide, left + Inches(0.05), top + Inches(0.38), Inches(1.85), Inches(0.3), f"{value:.2f}", Pt(16), bold=True, color=color, rtl=False)
 
 def add_subject_insight(slide, x, y, icon, title, subject_name, value, bg_color, border_color):
-    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(x), Inches(y), Inches(5.3), Inches(0.85))
+    left, top = Inches(x), Inches(y)
+    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, Inches(5.3), Inches(0.85))
     card.fill.solid()
     card.fill.fore_color.rgb = bg_color
     card.line.color.rgb = border_color
-    card.line.width = Pt(2)
-    p = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.08), Inches(5.1), Inches(0.35)).text_frame.paragraphs[0]
-    p.text = f"{icon} {title}"
-    p.font.size = Pt(11)
-    p.font.bold = True
-    p.font.color.rgb = border_color
-    p.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(p)
-    vp = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.43), Inches(5.1), Inches(0.35)).text_frame.paragraphs[0]
-    vp.text = f"{subject_name}: {value}"
-    vp.font.size = Pt(13)
-    vp.font.color.rgb = RGBColor(55, 65, 81)
-    vp.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(vp)
+    card.line.width = CARD_BORDER
+    add_text(slide, left + Inches(0.1), top + Inches(0.08), Inches(5.1), Inches(0.35), f"{icon} {title}", Pt(11), bold=True, color=border_color, align=PP_ALIGN.RIGHT)
+    add_text(slide, left + Inches(0.1), top + Inches(0.43), Inches(5.1), Inches(0.35), f"{subject_name}: {value}", Pt(13), color=BODY_TEXT, align=PP_ALIGN.RIGHT)
 
 def add_corr_card(slide, x, y, w, h, icon, title, line1, line2, bg_color, border_color):
-    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(x), Inches(y), Inches(w), Inches(h))
+    left, top, width = Inches(x), Inches(y), Inches(w)
+    inner_w = width - Inches(0.2)
+    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, width, Inches(h))
     card.fill.solid()
     card.fill.fore_color.rgb = bg_color
     card.line.color.rgb = border_color
-    card.line.width = Pt(2)
-    p = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.08), Inches(w - 0.2), Inches(0.35)).text_frame.paragraphs[0]
-    p.text = f"{icon} {title}"
-    p.font.size = Pt(13)
-    p.font.bold = True
-    p.font.color.rgb = border_color
-    p.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(p)
-    p1 = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.4), Inches(w - 0.2), Inches(0.3)).text_frame.paragraphs[0]
-    p1.text = line1
-    p1.font.size = Pt(11)
-    p1.font.color.rgb = RGBColor(55, 65, 81)
-    p1.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(p1)
-    p2 = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.65), Inches(w - 0.2), Inches(0.3)).text_frame.paragraphs[0]
-    p2.text = line2
-    p2.font.size = Pt(12)
-    p2.font.bold = True
-    p2.font.color.rgb = border_color
-    p2.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(p2)
+    card.line.width = CARD_BORDER
+    add_text(slide, left + Inches(0.1), top + Inches(0.08), inner_w, Inches(0.35), f"{icon} {title}", Pt(13), bold=True, color=border_color, align=PP_ALIGN.RIGHT)
+    add_text(slide, left + Inches(0.1), top + Inches(0.4), inner_w, Inches(0.3), line1, Pt(11), color=BODY_TEXT, align=PP_ALIGN.RIGHT)
+    add_text(slide, left + Inches(0.1), top + Inches(0.65), inner_w, Inches(0.3), line2, Pt(12), bold=True, color=border_color, align=PP_ALIGN.RIGHT)
 
 def add_insight_card(slide, x, y, icon, title, subject, value, bg_color, border_color):
-    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(x), Inches(y), Inches(4.3), Inches(0.85))
+    left, top = Inches(x), Inches(y)
+    card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, Inches(4.3), Inches(0.85))
     card.fill.solid()
     card.fill.fore_color.rgb = bg_color
     card.line.color.rgb = border_color
-    card.line.width = Pt(2)
-    p = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.1), Inches(4.1), Inches(0.35)).text_frame.paragraphs[0]
-    p.text = f"{icon} {title}"
-    p.font.size = Pt(12)
-    p.font.bold = True
-    p.font.color.rgb = border_color
-    p.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(p)
-    val_txt = slide.shapes.add_textbox(Inches(x + 0.1), Inches(y + 0.45), Inches(4.1), Inches(0.35)).text_frame.paragraphs[0]
-    val_txt.text = f"{subject}: {value}"
-    val_txt.font.size = Pt(13)
-    val_txt.font.color.rgb = RGBColor(55, 65, 81)
-    val_txt.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(val_txt)
+    card.line.width = CARD_BORDER
+    add_text(slide, left + Inches(0.1), top + Inches(0.1), Inches(4.1), Inches(0.35), f"{icon} {title}", Pt(12), bold=True, color=border_color, align=PP_ALIGN.RIGHT)
+    add_text(slide, left + Inches(0.1), top + Inches(0.45), Inches(4.1), Inches(0.35), f"{subject}: {value}", Pt(13), color=BODY_TEXT, align=PP_ALIGN.RIGHT)
+
+@st.cache_resource
+def subject_stats_kernel():
+    """Numba kernel giving per-column (mean, std, min, max, count, pass_count) of a 2-D grade
+    array, skipping NaN; None without numba. Built once per process so reruns don't recompile."""
+    if not NUMBA_AVAILABLE:
+        return None
+
+    @njit
+    def kernel(arr):
+        n_rows, n_cols = arr.shape
+        out = np.full((n_cols, 6), np.nan)
+        for j in range(n_cols):
+            total, count, passed = 0.0, 0, 0
+            lo, hi = np.inf, -np.inf
+            for i in range(n_rows):
+                v = arr[i, j]
+                if not np.isnan(v):
+                    total += v
+                    count += 1
+                    if v >= 10:
+                        passed += 1
+                    lo = min(lo, v)
+                    hi = max(hi, v)
+            out[j, 4] = count
+            out[j, 5] = passed
+            if count == 0:
+                continue
+            mean = total / count
+            sq_dev = 0.0
+            for i in range(n_rows):
+                v = arr[i, j]
+                if not np.isnan(v):
+                    sq_dev += (v - mean) ** 2
+            out[j, 0] = mean
+            if count > 1:
+                out[j, 1] = np.sqrt(sq_dev / (count - 1))
+            out[j, 2] = lo
+            out[j, 3] = hi
+        return out
+    return kernel
+
+def subject_stats_numpy(arr, mask):
+    """NumPy version of subject_stats_kernel, slicing each column with a precomputed non-NaN mask.
+    Columns are compacted before summing (as pandas does) so the results match it bit for bit."""
+    out = np.full((arr.shape[1], 6), np.nan)
+    for j in range(arr.shape[1]):
+        values = arr[mask[:, j], j]
+        count = len(values)
+        out[j, 4], out[j, 5] = count, (values >= 10).sum()
+        if count == 0:
+            continue
+        mean = values.sum() / count
+        out[j, 0], out[j, 2], out[j, 3] = mean, values.min(), values.max()
+        if count > 1:
+            out[j, 1] = np.sqrt(((values - mean) ** 2).sum() / (count - 1))
+    return out
+
+def subject_stats_rows(subjects, arr, mask):
+    """Per-subject mean/max/min/std/count/pass-rate rows for the slides"""
+    kernel = subject_stats_kernel()
+    stats = kernel(arr) if kernel is not None else subject_stats_numpy(arr, mask)
+    return [{'المادة': col, 'المتوسط': mean, 'الأعلى': hi, 'الأقل': lo, 'الانحراف المعياري': std,
+             'عدد الطلاب': int(count), 'نسبة_النجاح': passed / count * 100}
+            for col, (mean, std, lo, hi, count, passed) in zip(subjects, stats) if count > 0]
+
+def stacked_grades(data_df, columns):
+    """Non-NaN grades of the given columns as one array, column after column"""
+    present = [col for col in columns if col in data_df.columns]
+    grades = data_df[present].to_numpy(dtype=np.float64, na_value=np.nan).ravel(order='F')
+    return grades[~np.isnan(grades)]
+
+def row_means(data_df, columns):
+    """Each row's mean over the given columns, skipping NaN; NaN for a row without any grade"""
+    present = [col for col in columns if col in data_df.columns]
+    grades = data_df[present].to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(grades, axis=1) / (~np.isnan(grades)).sum(axis=1)
 
 def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt, title_suffix=""):
+    # Charts are queued here and rendered together once all slides are built
+    chart_jobs = []
+    # The subjects this sheet actually has, resolved once for every slide below
+    subjects_present = [col for col in subject_columns if col in data_df.columns]
+    
     # Title slide
     if len(selected_classes_ppt) == 1:
         classes_text = selected_classes_ppt[0]
@@ -513,8 +732,12 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
     min_grade = data_df['المعدل'].min()
     std_grade = data_df['المعدل'].std()
     num_classes = len(selected_classes_ppt)
-    pass_rate = (data_df['المعدل'] >= 10).mean() * 100
-    excellent_rate = (data_df['المعدل'] >= 14).mean() * 100
+    # Bucket every grade in one pass: <10, 10-11.99, 12-13.99, >=14 (missing grades count in no bucket)
+    all_grades = data_df['المعدل'].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid_grades = all_grades[~np.isnan(all_grades)]
+    bracket_counts = np.bincount(np.searchsorted([10.0, 12.0, 14.0], valid_grades, side='right'), minlength=4)
+    pass_rate = bracket_counts[1:].sum() / total_students * 100
+    excellent_rate = bracket_counts[3] / total_students * 100
     
     # Row 1: Main metrics (4 cards)
     add_stat_card(slide, 9.8, 1.3, 2.8, 1.6, "عدد التلاميذ", f"{total_students}", "👥", RGBColor(52, 73, 94))
@@ -553,21 +776,17 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
     set_paragraph_rtl(p)
     
     # Add explanation line
-    p2 = summary_frame.add_paragraph()
-    p2.text = "📌 نسبة النجاح: معدل ≥ 10 | نسبة التميز: معدل ≥ 14 (جيد جداً/ممتاز)"
-    p2.font.size = Pt(14)
-    p2.font.color.rgb = RGBColor(100, 100, 100)
-    p2.alignment = PP_ALIGN.CENTER
+    p2 = add_rtl_paragraph(summary_frame, "📌 نسبة النجاح: معدل ≥ 10 | نسبة التميز: معدل ≥ 14 (جيد جداً/ممتاز)", Pt(14),
+                           color=MUTED_TEXT, align=PP_ALIGN.CENTER)
     p2.space_before = Pt(8)
-    set_paragraph_rtl(p2)
     
     # Grade Brackets - Slide 2
     slide = add_content_slide(prs, "📊 توزيع شرائح المعدلات", 2)
     
-    below_avg_count = len(data_df[data_df['المعدل'] < 10])
-    avg_count = len(data_df[(data_df['المعدل'] >= 10) & (data_df['المعدل'] < 12)])
-    good_count = len(data_df[data_df['المعدل'] >= 12])
-    total = len(data_df)
+    below_avg_count = int(bracket_counts[0])
+    avg_count = int(bracket_counts[1])
+    good_count = int(bracket_counts[2] + bracket_counts[3])
+    total = total_students
     
     add_bracket_card(slide, 9.5, 1.3, 3.2, 1.4, "🔴", "دون المعدل (0-9.99)", below_avg_count, below_avg_count/total*100, 
                     RGBColor(255, 235, 235), RGBColor(231, 76, 60))
@@ -581,51 +800,30 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
     success_box.fill.fore_color.rgb = RGBColor(41, 128, 185)
     success_box.line.fill.background()
     
-    success_text = slide.shapes.add_textbox(Inches(9.5), Inches(6.0), Inches(3.2), Inches(0.45))
-    stf = success_text.text_frame
-    sp = stf.paragraphs[0]
-    sp.text = f"✅ نسبة النجاح: {(avg_count + good_count)/total*100:.1f}%"
-    sp.font.size = Pt(15)
-    sp.font.bold = True
-    sp.font.color.rgb = RGBColor(255, 255, 255)
-    sp.alignment = PP_ALIGN.CENTER
-    
-    # 3D-style Donut Pie chart
-    fig_pie = go.Figure(data=[go.Pie(
-        labels=[fix_arabic('دون المعدل<br>(0-9.99)'), fix_arabic('متوسط<br>(10-11.99)'), fix_arabic('جيد/ممتاز<br>(12-20)')],
-        values=[below_avg_count, avg_count, good_count],
-        hole=0.35,
-        marker=dict(colors=['#EF553B', '#FECB52', '#00CC96'], line=dict(color='white', width=3)),
-        textinfo='percent+value',
-        textfont=dict(size=20, color='white'),
-        textposition='inside',
-        pull=[0.05, 0.02, 0.02],
-        rotation=45,
-        direction='clockwise'
-    )])
-    
-    fig_pie.update_layout(
-        showlegend=True,
-        legend=dict(orientation="h", yanchor="bottom", y=-0.08, xanchor="center", x=0.5, font=dict(size=16)),
-        height=680, width=750, margin=dict(t=5, b=40, l=5, r=5), paper_bgcolor='rgba(0,0,0,0)',
-        annotations=[dict(text=f'<b>{total}</b><br>{fix_arabic("تلميذ")}', x=0.5, y=0.5, font=dict(size=26, color='#333'), showarrow=False)]
-    )
+    add_text(slide, Inches(9.5), Inches(6.0), Inches(3.2), Inches(0.45), f"✅ نسبة النجاح: {(avg_count + good_count)/total*100:.1f}%", Pt(15), bold=True, color=RGBColor(255, 255, 255), rtl=False)
     
-    img_stream = fig_to_image(fig_pie)
-    if img_stream:
-        slide.shapes.add_picture(img_stream, Inches(1.5), Inches(1.0), width=Inches(7.5))
+    # Donut Pie chart
+    fig_pie = pie_figure_mpl(
+        PIE_LABELS,
+        [below_avg_count, avg_count, good_count],
+        ['#EF553B', '#FECB52', '#00CC96'],
+        total
+    )
+    chart_jobs.append((slide, fig_pie, (Inches(1.5), Inches(1.0), Inches(7.5))))
     
     # Grade Distribution Histogram - Slide 3
     slide = add_content_slide(prs, "📈 توزيع المعدلات", 3)
-    grades = data_df['المعدل'].dropna()
+    grades = valid_grades
+    n_grades = len(grades)
     grade_mean = grades.mean()
-    grade_median = grades.median()
-    grade_std = grades.std()
-    grade_skew = grades.skew() if len(grades) > 2 else 0
-    q1 = grades.quantile(0.25)
-    q3 = grades.quantile(0.75)
+    grade_std = grades.std(ddof=1)
+    q1, grade_median, q3 = np.quantile(grades, [0.25, 0.5, 0.75]) if n_grades else (np.nan, np.nan, np.nan)
+    # Adjusted Fisher-Pearson skewness, as computed by Series.skew()
+    centered = grades - grade_mean
+    m2, m3 = (centered ** 2).mean(), (centered ** 3).mean()
+    grade_skew = np.sqrt(n_grades * (n_grades - 1)) / (n_grades - 2) * m3 / m2 ** 1.5 if n_grades > 2 and m2 > 0 else 0
     iqr = q3 - q1
-    passing_rate = (grades >= 10).sum() / len(grades) * 100
+    passing_rate = bracket_counts[1:].sum() / n_grades * 100
     
     if grade_skew > 0.5:
         skew_text, skew_emoji, skew_color = "التوزيع مائل لليمين (معظم الدرجات منخفضة)", "⚠️", RGBColor(231, 76, 60)
@@ -634,24 +832,10 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
     else:
         skew_text, skew_emoji, skew_color = "التوزيع متماثل تقريباً (طبيعي)", "📊", RGBColor(52, 152, 219)
     
-    fig_hist = go.Figure()
-    fig_hist.add_trace(go.Histogram(x=grades, nbinsx=20, marker=dict(color='rgba(99, 110, 250, 0.7)', line=dict(color='rgba(99, 110, 250, 1)', width=1))))
-    fig_hist.add_vline(x=grade_mean, line_dash="dash", line_color="red", line_width=2, annotation_text=f"{fix_arabic('المتوسط')}: {grade_mean:.2f}", annotation_position="top right")
-    fig_hist.add_vline(x=grade_median, line_dash="dot", line_color="green", line_width=2, annotation_text=f"{fix_arabic('الوسيط')}: {grade_median:.2f}", annotation_position="top left")
-    fig_hist.add_vline(x=10, line_dash="solid", line_color="orange", line_width=2, annotation_text=fix_arabic("حد النجاح (10)"), annotation_position="bottom right")
-    fig_hist.update_layout(height=380, width=580, xaxis_title=fix_arabic("المعدل"), yaxis_title=fix_arabic("عدد التلاميذ"), showlegend=False, margin=dict(t=20, b=40, l=40, r=20))
-    
-    img_stream = fig_to_image(fig_hist)
-    if img_stream:
-        slide.shapes.add_picture(img_stream, Inches(0.2), Inches(1.1), width=Inches(5.8))
-    
-    ititle = slide.shapes.add_textbox(Inches(6.2), Inches(1.1), Inches(6.3), Inches(0.5)).text_frame.paragraphs[0]
-    ititle.text = "📊 رؤى إحصائية"
-    ititle.font.size = Pt(22)
-    ititle.font.bold = True
-    ititle.font.color.rgb = PRIMARY_COLOR
-    ititle.alignment = PP_ALIGN.RIGHT
-    set_paragraph_rtl(ititle)
+    fig_hist = hist_figure_mpl(grades, grade_mean, grade_median)
+    chart_jobs.append((slide, fig_hist, (Inches(0.2), Inches(1.1), Inches(5.8))))
+    
+    add_text(slide, Inches(6.2), Inches(1.1), Inches(6.3), Inches(0.5), "📊 رؤى إحصائية", Pt(22), bold=True, color=PRIMARY_COLOR, align=PP_ALIGN.RIGHT)
     
     add_fancy_stat(slide, 6.2, 1.6, "📍", "المتوسط", f"{grade_mean:.2f}", RGBColor(254, 226, 226), RGBColor(220, 38, 38))
     add_fancy_stat(slide, 9.3, 1.6, "📌", "الوسيط", f"{grade_median:.2f}", RGBColor(220, 252, 231), RGBColor(22, 163, 74))
@@ -665,10 +849,7 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
     else: pbox.fill.fore_color.rgb, pcolor, picon = RGBColor(254, 226, 226), RGBColor(220, 38, 38), "⚠️"
     pbox.line.color.rgb = pcolor
     pbox.line.width = Pt(2)
-    pp = slide.shapes.add_textbox(Inches(6.3), Inches(3.2), Inches(5.9), Inches(0.5)).text_frame.paragraphs[0]
-    pp.text = f"{picon} نسبة النجاح: {passing_rate:.1f}%"
-    pp.font.size = Pt(20)
-    pp.font.bold, pp.font.color.rgb, pp.alignment = True, pcolor, PP_ALIGN.CENTER
+    add_text(slide, Inches(6.3), Inches(3.2), Inches(5.9), Inches(0.5), f"{picon} نسبة النجاح: {passing_rate:.1f}%", Pt(20), bold=True, color=pcolor, rtl=False)
     
     add_quartile_card(slide, 6.2, 4.3, "الربع الأول (25%)", q1, RGBColor(239, 68, 68))
     add_quartile_card(slide, 8.25, 4.3, "الوسيط (50%)", grade_median, RGBColor(234, 179, 8))
@@ -677,134 +858,116 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
     ibox = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(0.2), Inches(5.1), Inches(5.8), Inches(1.1))
     ibox.fill.solid()
     ibox.fill.fore_color.rgb, ibox.line.color.rgb, ibox.line.width = RGBColor(255, 251, 235), skew_color, Pt(2.5)
-    ip1 = slide.shapes.add_textbox(Inches(0.3), Inches(5.15), Inches(5.6), Inches(0.35)).text_frame.paragraphs[0]
-    ip1.text = "💡 تحليل شكل التوزيع"
-    ip1.font.size, ip1.font.bold, ip1.font.color.rgb, ip1.alignment = Pt(14), True, skew_color, PP_ALIGN.RIGHT
-    set_paragraph_rtl(ip1)
+    add_text(slide, Inches(0.3), Inches(5.15), Inches(5.6), Inches(0.35), "💡 تحليل شكل التوزيع", Pt(14), bold=True, color=skew_color, align=PP_ALIGN.RIGHT)
     itf2 = slide.shapes.add_textbox(Inches(0.3), Inches(5.5), Inches(5.6), Inches(0.6)).text_frame
     itf2.word_wrap = True
     ip2 = itf2.paragraphs[0]
     ip2.text = f"{skew_emoji} {skew_text}"
     ip2.font.size, ip2.font.color.rgb, ip2.alignment = Pt(13), RGBColor(60, 60, 60), PP_ALIGN.RIGHT
     set_paragraph_rtl(ip2)
-    ip3 = itf2.add_paragraph()
-    ip3.text = f"معامل الالتواء: {grade_skew:.3f}"
-    ip3.font.size, ip3.font.color.rgb, ip3.alignment = Pt(11), RGBColor(100, 100, 100), PP_ALIGN.RIGHT
-    set_paragraph_rtl(ip3)
+    add_rtl_paragraph(itf2, f"معامل الالتواء: {grade_skew:.3f}", Pt(11), color=MUTED_TEXT)
     
     # Average by Subject - Slide 4
     slide = add_content_slide(prs, "📚 متوسط المعدلات حسب المادة", 4)
-    stats_data_ppt = []
-    for col in subject_columns:
-        if col in data_df.columns:
-            valid_data = data_df[col].dropna()
-            if len(valid_data) > 0:
-                stats_data_ppt.append({'المادة': col, 'المتوسط': valid_data.mean(), 'الأعلى': valid_data.max(), 'الأقل': valid_data.min(), 'الانحراف المعياري': valid_data.std(), 'عدد الطلاب': len(valid_data), 'نسبة_النجاح': (valid_data >= 10).sum() / len(valid_data) * 100})
-    stats_df_ppt = pd.DataFrame(stats_data_ppt)
+    # One grade matrix and NaN mask shared by the per-subject statistics of slides 4-6
+    subject_arr = data_df[subjects_present].to_numpy(dtype=np.float64, na_value=np.nan)
+    subject_mask = ~np.isnan(subject_arr)
+    # Chart tick labels for the subjects, reshaped once for every slide that plots them
+    subject_labels = {col: fix_arabic(col) for col in subjects_present}
+    subject_counts = subject_mask.sum(axis=0)
+    subject_rows = subject_stats_rows(subjects_present, subject_arr, subject_mask)
+    stats_df_ppt = pd.DataFrame(subject_rows)
+    # Means and pass rates from the same counts, reused by the enrichment and language slides
+    subject_means = {row['المادة']: row['المتوسط'] for row in subject_rows}
+    subject_pass_rates = {row['المادة']: row['نسبة_النجاح'] for row in subject_rows}
     stats_df_sorted = stats_df_ppt.sort_values('المتوسط', ascending=True)
     colors = ['#00CC96' if v >= 12 else ('#FECB52' if v >= 10 else '#EF553B') for v in stats_df_sorted['المتوسط']]
-    fig_bar = go.Figure(go.Bar(y=[fix_arabic(m) for m in stats_df_sorted['المادة']], x=stats_df_sorted['المتوسط'], orientation='h', marker=dict(color=colors, line=dict(color='white', width=1)), text=[f"{v:.2f}" for v in stats_df_sorted['المتوسط']], textposition='outside'))
-    fig_bar.add_vline(x=10, line_dash="dash", line_color="orange", line_width=2, annotation_text=fix_arabic("حد النجاح"), annotation_position="top")
-    fig_bar.update_layout(height=420, width=720, xaxis_title=fix_arabic("المتوسط"), yaxis_title="", showlegend=False, margin=dict(t=20, b=40, l=120, r=50), xaxis=dict(range=[0, 20]))
-    img_stream = fig_to_image(fig_bar)
-    if img_stream: slide.shapes.add_picture(img_stream, Inches(0.2), Inches(1.15), width=Inches(7.2))
+    fig_bar = subject_means_figure_mpl([subject_labels[m] for m in stats_df_sorted['المادة']], stats_df_sorted['المتوسط'].tolist(), colors)
+    chart_jobs.append((slide, fig_bar, (Inches(0.2), Inches(1.15), Inches(7.2))))
     
     if len(stats_df_ppt) > 0:
+        # Subject winners are picked once here; slide 8 reuses them
         best_subject = stats_df_ppt.loc[stats_df_ppt['المتوسط'].idxmax()]
         worst_subject = stats_df_ppt.loc[stats_df_ppt['المتوسط'].idxmin()]
+        most_consistent = stats_df_ppt.loc[stats_df_ppt['الانحراف المعياري'].idxmin()]
+        most_varied = stats_df_ppt.loc[stats_df_ppt['الانحراف المعياري'].idxmax()]
         highest_pass = stats_df_ppt.loc[stats_df_ppt['نسبة_النجاح'].idxmax()]
         lowest_pass = stats_df_ppt.loc[stats_df_ppt['نسبة_النجاح'].idxmin()]
         overall_avg = stats_df_ppt['المتوسط'].mean()
-        ititle = slide.shapes.add_textbox(Inches(7.5), Inches(1.15), Inches(5.5), Inches(0.4)).text_frame.paragraphs[0]
-        ititle.text = "📊 رؤى تحليلية"
-        ititle.font.size, ititle.font.bold, ititle.font.color.rgb, ititle.alignment = Pt(18), True, PRIMARY_COLOR, PP_ALIGN.RIGHT
-        set_paragraph_rtl(ititle)
-        add_subject_insight(slide, 7.5, 1.6, "🏆", "أفضل مادة (أعلى متوسط)", best_subject['المادة'], f"{best_subject['المتوسط']:.2f}", RGBColor(220, 252, 231), RGBColor(22, 163, 74))
-        add_subject_insight(slide, 7.5, 2.55, "⚠️", "أضعف مادة (أدنى متوسط)", worst_subject['المادة'], f"{worst_subject['المتوسط']:.2f}", RGBColor(254, 226, 226), RGBColor(220, 38, 38))
-        add_subject_insight(slide, 7.5, 3.5, "✅", "أعلى نسبة نجاح", highest_pass['المادة'], f"{highest_pass['نسبة_النجاح']:.1f}%", RGBColor(219, 234, 254), RGBColor(37, 99, 235))
-        add_subject_insight(slide, 7.5, 4.45, "📉", "أدنى نسبة نجاح", lowest_pass['المادة'], f"{lowest_pass['نسبة_النجاح']:.1f}%", RGBColor(254, 249, 195), RGBColor(202, 138, 4))
+        add_text(slide, Inches(7.5), Inches(1.15), Inches(5.5), Inches(0.4), "📊 رؤى تحليلية", Pt(18), bold=True, color=PRIMARY_COLOR, align=PP_ALIGN.RIGHT)
+        subject_cards = [
+            (1.6, "🏆", "أفضل مادة (أعلى متوسط)", best_subject['المادة'], f"{best_subject['المتوسط']:.2f}", CARD_GREEN),
+            (2.55, "⚠️", "أضعف مادة (أدنى متوسط)", worst_subject['المادة'], f"{worst_subject['المتوسط']:.2f}", CARD_RED),
+            (3.5, "✅", "أعلى نسبة نجاح", highest_pass['المادة'], f"{highest_pass['نسبة_النجاح']:.1f}%", CARD_BLUE),
+            (4.45, "📉", "أدنى نسبة نجاح", lowest_pass['المادة'], f"{lowest_pass['نسبة_النجاح']:.1f}%", CARD_YELLOW),
+        ]
+        for y, icon, title, name, value, (bg_color, border_color) in subject_cards:
+            add_subject_insight(slide, 7.5, y, icon, title, name, value, bg_color, border_color)
         abox = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(7.5), Inches(5.5), Inches(5.3), Inches(0.7))
         abox.fill.solid()
         abox.fill.fore_color.rgb = PRIMARY_COLOR
-        ap = slide.shapes.add_textbox(Inches(7.5), Inches(5.6), Inches(5.3), Inches(0.5)).text_frame.paragraphs[0]
-        ap.text = f"📈 المتوسط العام لجميع المواد: {overall_avg:.2f}"
-        ap.font.size, ap.font.bold, ap.font.color.rgb, ap.alignment = Pt(16), True, RGBColor(255, 255, 255), PP_ALIGN.CENTER
+        add_text(slide, Inches(7.5), Inches(5.6), Inches(5.3), Inches(0.5), f"📈 المتوسط العام لجميع المواد: {overall_avg:.2f}", Pt(16), bold=True, color=RGBColor(255, 255, 255), rtl=False)
     
     # Subject Failure Analysis - Slide 5
     slide = add_content_slide(prs, "📊 تحليل نسب الرسوب في المواد", 5)
-    subject_failure_ppt = []
-    for col in subject_columns:
-        if col != 'المعدل' and col in data_df.columns:
-            sub_data = data_df[col].dropna()
-            if len(sub_data) > 0: subject_failure_ppt.append({'المادة': col, 'نسبة الرسوب': (sub_data < 10).mean() * 100})
+    with np.errstate(invalid='ignore', divide='ignore'):
+        failure_rates = (subject_arr < 10).sum(axis=0) / subject_counts * 100
+    subject_failure_ppt = [{'المادة': col, 'نسبة الرسوب': rate}
+                           for col, rate, count in zip(subjects_present, failure_rates, subject_counts)
+                           if col != 'المعدل' and count > 0]
     if subject_failure_ppt:
         fdf = pd.DataFrame(subject_failure_ppt).sort_values('نسبة الرسوب', ascending=False)
-        fig_f = px.bar(fdf, x=[fix_arabic(m) for m in fdf['المادة']], y='نسبة الرسوب', color='نسبة الرسوب', color_continuous_scale='RdYlGn_r', text='نسبة الرسوب')
-        fig_f.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-        fig_f.update_layout(height=450, width=1000, xaxis_title=fix_arabic("المادة"), yaxis_title=fix_arabic("نسبة الرسوب"))
-        fig_f.add_hline(y=50, line_dash="dash", line_color="red", annotation_text=fix_arabic("خط الخطر"))
-        img_stream = fig_to_image(fig_f)
-        if img_stream: slide.shapes.add_picture(img_stream, Inches(1.5), Inches(1.3), width=Inches(10))
+        fig_f = bar_figure_mpl([subject_labels[m] for m in fdf['المادة']], fdf['نسبة الرسوب'].tolist(), scale_colors(fdf['نسبة الرسوب'], 'RdYlGn_r'),
+                               value_fmt="{:.1f}%", xlabel=LABEL_SUBJECT, ylabel=LABEL_FAILURE_RATE, hline=50, hline_color="red", hline_label=LABEL_DANGER_LINE)
+        chart_jobs.append((slide, fig_f, (Inches(1.5), Inches(1.3), Inches(10))))
     
     # Box Plot - Slide 6
     slide = add_content_slide(prs, "📊 توزيع المعدلات حسب المادة (مخطط صندوقي)", 6)
-    sdata_list, sstats = [], {}
-    for col in subject_columns:
-        if col in data_df.columns:
-            vd = data_df[col].dropna()
-            if len(vd) > 0: sstats[col] = {'median': vd.median(), 'mean': vd.mean(), 'std': vd.std(), 'iqr': vd.quantile(0.75) - vd.quantile(0.25)}
-            for g in vd: sdata_list.append({'المادة': col, 'التقدير': g})
-    if sdata_list:
-        sbdf = pd.DataFrame(sdata_list)
-        sbdf['المادة_fixed'] = sbdf['المادة'].apply(fix_arabic)
-        fig_b = px.box(sbdf, x='المادة_fixed', y='التقدير', color='المادة_fixed', color_discrete_sequence=px.colors.qualitative.Set2)
-        fig_b.update_layout(height=700, width=1200, showlegend=False, xaxis_title=fix_arabic("المادة"), yaxis_title=fix_arabic("التقدير"), font=dict(size=16), margin=dict(t=30, b=60, l=60, r=30))
-        img_stream = fig_to_image(fig_b)
-        if img_stream: slide.shapes.add_picture(img_stream, Inches(0.3), Inches(1.1), width=Inches(7.8))
+    sstats = {}
+    valid_cols = subject_counts > 0
+    if valid_cols.any():
+        # stats_df_ppt holds exactly the subjects with at least one grade, in the same order
+        q1s, medians, q3s = np.nanquantile(subject_arr[:, valid_cols], [0.25, 0.5, 0.75], axis=0)
+        for col, mean, std, q1, median, q3 in zip(stats_df_ppt['المادة'], stats_df_ppt['المتوسط'], stats_df_ppt['الانحراف المعياري'], q1s, medians, q3s):
+            sstats[col] = {'median': median, 'mean': mean, 'std': std, 'iqr': q3 - q1}
+        box_cols = np.flatnonzero(valid_cols)
+        fig_b = box_figure_mpl([subject_labels[subjects_present[j]] for j in box_cols], [subject_arr[subject_mask[:, j], j] for j in box_cols])
+        chart_jobs.append((slide, fig_b, (Inches(0.3), Inches(1.1), Inches(7.8))))
         if sstats:
             best_s = max(sstats.items(), key=lambda x: x[1]['median'])
             worst_s = min(sstats.items(), key=lambda x: x[1]['median'])
             most_v = max(sstats.items(), key=lambda x: x[1]['std'])
             most_c = min(sstats.items(), key=lambda x: x[1]['std'])
-            ititle = slide.shapes.add_textbox(Inches(8.3), Inches(1.1), Inches(4.5), Inches(0.4)).text_frame.paragraphs[0]
-            ititle.text = "💡 رؤى تحليلية"
-            ititle.font.size, ititle.font.bold, ititle.font.color.rgb, ititle.alignment = Pt(18), True, PRIMARY_COLOR, PP_ALIGN.RIGHT
-            set_paragraph_rtl(ititle)
-            add_insight_card(slide, 8.3, 1.5, "🏆", "أفضل مادة (أعلى وسيط)", best_s[0], f"{best_s[1]['median']:.2f}", RGBColor(220, 252, 231), RGBColor(22, 163, 74))
-            add_insight_card(slide, 8.3, 2.4, "⚠️", "أضعف مادة (أدنى وسيط)", worst_s[0], f"{worst_s[1]['median']:.2f}", RGBColor(254, 226, 226), RGBColor(220, 38, 38))
-            add_insight_card(slide, 8.3, 3.3, "📊", "أكثر تفاوتاً (أعلى انحراف)", most_v[0], f"σ = {most_v[1]['std']:.2f}", RGBColor(254, 249, 195), RGBColor(202, 138, 4))
-            add_insight_card(slide, 8.3, 4.2, "✅", "أكثر اتساقاً (أدنى انحراف)", most_c[0], f"σ = {most_c[1]['std']:.2f}", RGBColor(219, 234, 254), RGBColor(37, 99, 235))
+            add_text(slide, Inches(8.3), Inches(1.1), Inches(4.5), Inches(0.4), "💡 رؤى تحليلية", Pt(18), bold=True, color=PRIMARY_COLOR, align=PP_ALIGN.RIGHT)
+            spread_cards = [
+                (1.5, "🏆", "أفضل مادة (أعلى وسيط)", best_s[0], f"{best_s[1]['median']:.2f}", CARD_GREEN),
+                (2.4, "⚠️", "أضعف مادة (أدنى وسيط)", worst_s[0], f"{worst_s[1]['median']:.2f}", CARD_RED),
+                (3.3, "📊", "أكثر تفاوتاً (أعلى انحراف)", most_v[0], f"σ = {most_v[1]['std']:.2f}", CARD_YELLOW),
+                (4.2, "✅", "أكثر اتساقاً (أدنى انحراف)", most_c[0], f"σ = {most_c[1]['std']:.2f}", CARD_BLUE),
+            ]
+            for y, icon, title, name, value, (bg_color, border_color) in spread_cards:
+                add_insight_card(slide, 8.3, y, icon, title, name, value, bg_color, border_color)
     
     # Top & Bottom Performers - Slide 7
     slide = add_content_slide(prs, "🏆 أفضل وأضعف التلاميذ", 7)
-    top_10 = data_df[['اسم التلميذ', 'المعدل']].dropna().nlargest(10, 'المعدل')
-    bottom_10 = data_df[['اسم التلميذ', 'المعدل']].dropna().nsmallest(10, 'المعدل')
+    # Stable sorts rank tied averages by row order, like nlargest/nsmallest with keep='first'
+    student_names = data_df['اسم التلميذ'].to_numpy()
+    ranked = np.flatnonzero(data_df['اسم التلميذ'].notna().to_numpy() & ~np.isnan(all_grades))
+    top_10 = ranked[np.argsort(-all_grades[ranked], kind='stable')[:10]]
+    bottom_10 = ranked[np.argsort(all_grades[ranked], kind='stable')[:10]]
     t_text = "🥇 أفضل 10 تلاميذ:\n"
     emojis = ['🥇', '🥈', '🥉', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟']
-    for i, (_, r) in enumerate(top_10.iterrows()): t_text += f"{emojis[i]} {r['اسم التلميذ']}: {r['المعدل']:.2f}\n"
+    for emoji, name, avg in zip(emojis, student_names[top_10], all_grades[top_10]): t_text += f"{emoji} {name}: {avg:.2f}\n"
     tf = slide.shapes.add_textbox(Inches(6.5), Inches(1.3), Inches(6.3), Inches(5.5)).text_frame
-    for line in t_text.strip().split('\n'):
-        p = tf.add_paragraph()
-        p.text = line
-        p.font.size, p.alignment = Pt(16), PP_ALIGN.RIGHT
-        set_paragraph_rtl(p)
+    add_rtl_lines(tf, t_text.strip().split('\n'), Pt(16))
     b_text = "📉 أضعف 10 تلاميذ (يحتاجون دعماً):\n"
-    for _, r in bottom_10.iterrows(): b_text += f"• {r['اسم التلميذ']}: {r['المعدل']:.2f}\n"
+    for name, avg in zip(student_names[bottom_10], all_grades[bottom_10]): b_text += f"• {name}: {avg:.2f}\n"
     bf = slide.shapes.add_textbox(Inches(0.5), Inches(1.3), Inches(6), Inches(5.5)).text_frame
-    for line in b_text.strip().split('\n'):
-        p = bf.add_paragraph()
-        p.text = line
-        p.font.size, p.alignment = Pt(16), PP_ALIGN.RIGHT
-        set_paragraph_rtl(p)
+    add_rtl_lines(bf, b_text.strip().split('\n'), Pt(16))
 
     # Subject Insights - Slide 8
     slide = add_content_slide(prs, "💡 أهم الملاحظات", 8)
     if len(stats_df_ppt) > 0:
-        best_subject = stats_df_ppt.loc[stats_df_ppt['المتوسط'].idxmax()]
-        worst_subject = stats_df_ppt.loc[stats_df_ppt['المتوسط'].idxmin()]
-        most_consistent = stats_df_ppt.loc[stats_df_ppt['الانحراف المعياري'].idxmin()]
-        most_varied = stats_df_ppt.loc[stats_df_ppt['الانحراف المعياري'].idxmax()]
-        
         insights_text = f"""
 ✅ أفضل مادة أداءً: {best_subject['المادة']} (المتوسط: {best_subject['المتوسط']:.2f})
 ⚠️ مادة تحتاج اهتماماً: {worst_subject['المادة']} (المتوسط: {worst_subject['المتوسط']:.2f})
@@ -816,99 +979,56 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
         insights_box = slide.shapes.add_textbox(Inches(0.5), Inches(1.5), Inches(12), Inches(5))
         insights_frame = insights_box.text_frame
         insights_frame.word_wrap = True
-        for line in insights_text.strip().split('\n'):
-            p = insights_frame.add_paragraph()
-            p.text = line.strip()
-            p.font.size = Pt(24)
-            p.space_after = Pt(12)
-            p.alignment = PP_ALIGN.RIGHT
-            set_paragraph_rtl(p)
+        add_rtl_lines(insights_frame, [line.strip() for line in insights_text.strip().split('\n')], Pt(24), space_after=Pt(12))
 
     # Science vs Humanities Slide - Slide 9
     slide = add_content_slide(prs, "🔬📚 مقارنة العلوم والآداب", 9)
     science_subjects_ppt = ['الرياضيات', 'علوم الحياة والأرض', 'الفيزياء والكيمياء']
     humanities_subjects_ppt = ['اللغة العربية', 'اللغة الفرنسية', 'اللغة الإنجليزية', 'الاجتماعيات', 'التربية الإسلامية']
-    science_scores_ppt = []
-    humanities_scores_ppt = []
-    for col in science_subjects_ppt:
-        if col in data_df.columns:
-            science_scores_ppt.extend(data_df[col].dropna().tolist())
-    for col in humanities_subjects_ppt:
-        if col in data_df.columns:
-            humanities_scores_ppt.extend(data_df[col].dropna().tolist())
-    science_avg_ppt = np.mean(science_scores_ppt) if science_scores_ppt else 0
-    humanities_avg_ppt = np.mean(humanities_scores_ppt) if humanities_scores_ppt else 0
+    science_scores_ppt = stacked_grades(data_df, science_subjects_ppt)
+    humanities_scores_ppt = stacked_grades(data_df, humanities_subjects_ppt)
+    science_avg_ppt = science_scores_ppt.mean() if science_scores_ppt.size else 0
+    humanities_avg_ppt = humanities_scores_ppt.mean() if humanities_scores_ppt.size else 0
     diff_ppt = science_avg_ppt - humanities_avg_ppt
     orientation = "توجه علمي" if diff_ppt > 0.5 else ("توجه أدبي" if diff_ppt < -0.5 else "متوازن")
     sci_hum_text = f"🔬 متوسط المواد العلمية: {science_avg_ppt:.2f}\n(الرياضيات، علوم الحياة والأرض، الفيزياء والكيمياء)\n\n📚 متوسط المواد الأدبية: {humanities_avg_ppt:.2f}\n(العربية، الفرنسية، الإنجليزية، الاجتماعيات، التربية الإسلامية)\n\n📊 الفرق: {diff_ppt:.2f} نقطة\n\n🎯 التوجه العام: {orientation}"
     sci_hum_box = slide.shapes.add_textbox(Inches(6.5), Inches(1.3), Inches(6.3), Inches(5))
     sci_hum_frame = sci_hum_box.text_frame
     sci_hum_frame.word_wrap = True
-    for line in sci_hum_text.strip().split('\n'):
-        p = sci_hum_frame.add_paragraph()
-        p.text = line
-        p.font.size = Pt(22)
-        p.space_after = Pt(8)
-        p.alignment = PP_ALIGN.RIGHT
-        set_paragraph_rtl(p)
-    comparison_df_ppt = pd.DataFrame({fix_arabic('المجال'): [fix_arabic('المواد العلمية'), fix_arabic('المواد الأدبية')], fix_arabic('المتوسط'): [science_avg_ppt, humanities_avg_ppt]})
-    fig_comparison = px.bar(comparison_df_ppt, x=fix_arabic('المجال'), y=fix_arabic('المتوسط'), color=fix_arabic('المجال'), 
-                           color_discrete_map={fix_arabic('المواد العلمية'): '#636EFA', fix_arabic('المواد الأدبية'): '#EF553B'}, text=fix_arabic('المتوسط'))
-    fig_comparison.update_traces(texttemplate='%{text:.2f}', textposition='outside')
-    fig_comparison.update_layout(height=400, width=500, showlegend=False)
-    fig_comparison.add_hline(y=10, line_dash="dash", line_color="green")
-    img_stream = fig_to_image(fig_comparison)
-    if img_stream:
-        slide.shapes.add_picture(img_stream, Inches(0.5), Inches(1.3), width=Inches(6))
+    add_rtl_lines(sci_hum_frame, sci_hum_text.strip().split('\n'), Pt(22), space_after=Pt(8))
+    fig_comparison = bar_figure_mpl(list(FIELD_COLORS), [science_avg_ppt, humanities_avg_ppt], list(FIELD_COLORS.values()),
+                                    xlabel=LABEL_FIELD, ylabel=LABEL_MEAN, hline=10)
+    chart_jobs.append((slide, fig_comparison, (Inches(0.5), Inches(1.3), Inches(6))))
 
     # ====== ENRICHMENT SUBJECTS SLIDE ====== Slide 10
     slide = add_content_slide(prs, "🎨 مواد التفتح (الأنشطة)", 10)
     enrichment_subjects_ppt = ['التربية البدنية', 'المعلوميات', 'التربية التشكيلية']
-    enrichment_data_ppt = []
-    for subj in enrichment_subjects_ppt:
-        if subj in data_df.columns:
-            # Safety: Ensure data is numeric
-            s_data = pd.to_numeric(data_df[subj].astype(str).str.replace(',', '.'), errors='coerce').dropna()
-            if len(s_data) > 0:
-                avg_val = s_data.mean()
-                pass_rate = (s_data >= 10).mean() * 100
-                enrichment_data_ppt.append({'المادة': subj, 'المتوسط': avg_val, 'نسبة النجاح': pass_rate})
+    # subject_means only holds subjects with at least one grade, so no per-subject value copy is needed here
+    enrichment_data_ppt = [{'المادة': subj, 'المتوسط': subject_means[subj], 'نسبة النجاح': subject_pass_rates[subj]}
+                           for subj in enrichment_subjects_ppt if subj in subject_means]
     if enrichment_data_ppt:
-        enrichment_df_ppt = pd.DataFrame(enrichment_data_ppt)
         enrichment_text = "📊 أداء التلاميذ في مواد التفتح:\n\n"
-        for _, row in enrichment_df_ppt.iterrows():
+        for row in enrichment_data_ppt:
             emoji = "✅" if row['المتوسط'] >= 10 else "⚠️"
             enrichment_text += f"{emoji} {row['المادة']}: {row['المتوسط']:.2f} (نجاح: {row['نسبة النجاح']:.0f}%)\n"
         enr_box = slide.shapes.add_textbox(Inches(6.5), Inches(1.3), Inches(6.3), Inches(5))
         enr_frame = enr_box.text_frame
         enr_frame.word_wrap = True
-        for line in enrichment_text.strip().split('\n'):
-            p = enr_frame.add_paragraph()
-            p.text = line
-            p.font.size = Pt(20)
-            p.space_after = Pt(6)
-            p.alignment = PP_ALIGN.RIGHT
-            set_paragraph_rtl(p)
-        fig_enr = px.bar(enrichment_df_ppt, x=[fix_arabic(m) for m in enrichment_df_ppt['المادة']], y='المتوسط', color='المتوسط', color_continuous_scale='RdYlGn', text='المتوسط')
-        fig_enr.update_traces(texttemplate='%{text:.2f}', textposition='outside')
-        fig_enr.update_layout(height=500, width=650, showlegend=False)
-        fig_enr.add_hline(y=10, line_dash="dash", line_color="green")
-        img_stream = fig_to_image(fig_enr)
-        if img_stream:
-            slide.shapes.add_picture(img_stream, Inches(0.3), Inches(1.2), width=Inches(7))
+        add_rtl_lines(enr_frame, enrichment_text.strip().split('\n'), Pt(20), space_after=Pt(6))
+        enr_means = [row['المتوسط'] for row in enrichment_data_ppt]
+        fig_enr = bar_figure_mpl([subject_labels[row['المادة']] for row in enrichment_data_ppt], enr_means, scale_colors(enr_means, 'RdYlGn'),
+                                 xlabel=LABEL_SUBJECT, ylabel=LABEL_MEAN, hline=10)
+        chart_jobs.append((slide, fig_enr, (Inches(0.3), Inches(1.2), Inches(7))))
 
     # ====== LANGUAGE SUCCESS RATES SLIDE ====== Slide 11
     slide = add_content_slide(prs, "📊 نسبة النجاح في اللغات", 11)
-    ar_pass_ppt = (data_df['اللغة العربية'].dropna() >= 10).mean() * 100 if 'اللغة العربية' in data_df.columns else 0
-    fr_pass_ppt = (data_df['اللغة الفرنسية'].dropna() >= 10).mean() * 100 if 'اللغة الفرنسية' in data_df.columns else 0
-    en_pass_ppt = (data_df['اللغة الإنجليزية'].dropna() >= 10).mean() * 100 if 'اللغة الإنجليزية' in data_df.columns else 0
-    pass_df_ppt = pd.DataFrame({fix_arabic('اللغة'): [fix_arabic('العربية'), fix_arabic('الفرنسية'), fix_arabic('الإنجليزية')], fix_arabic('نسبة النجاح %'): [ar_pass_ppt, fr_pass_ppt, en_pass_ppt]})
-    fig_pass = px.bar(pass_df_ppt, x=fix_arabic('اللغة'), y=fix_arabic('نسبة النجاح %'), color=fix_arabic('نسبة النجاح %'), color_continuous_scale='RdYlGn', text=fix_arabic('نسبة النجاح %'))
-    fig_pass.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-    fig_pass.update_layout(height=400, width=500, title=fix_arabic("نسبة النجاح في كل لغة (≥10)"))
-    img_stream_pass = fig_to_image(fig_pass)
-    if img_stream_pass:
-        slide.shapes.add_picture(img_stream_pass, Inches(0.5), Inches(1.3), width=Inches(6))
+    ar_pass_ppt = subject_pass_rates.get('اللغة العربية', np.nan) if 'اللغة العربية' in subjects_present else 0
+    fr_pass_ppt = subject_pass_rates.get('اللغة الفرنسية', np.nan) if 'اللغة الفرنسية' in subjects_present else 0
+    en_pass_ppt = subject_pass_rates.get('اللغة الإنجليزية', np.nan) if 'اللغة الإنجليزية' in subjects_present else 0
+    lang_pass_ppt = [ar_pass_ppt, fr_pass_ppt, en_pass_ppt]
+    fig_pass = bar_figure_mpl(LANGUAGE_LABELS, lang_pass_ppt, scale_colors(lang_pass_ppt, 'RdYlGn'), value_fmt="{:.1f}%",
+                              xlabel=LABEL_LANGUAGE, ylabel=LABEL_PASS_RATE_PCT, title=LABEL_LANGUAGE_PASS_TITLE)
+    chart_jobs.append((slide, fig_pass, (Inches(0.5), Inches(1.3), Inches(6))))
     success_analysis = f"📈 نسب النجاح في اللغات:\n\n🇲🇦 العربية: {ar_pass_ppt:.1f}%\n🇫🇷 الفرنسية: {fr_pass_ppt:.1f}%\n🇬🇧 الإنجليزية: {en_pass_ppt:.1f}%\n\n"
     struggling_langs_ppt = []
     if fr_pass_ppt < 50: struggling_langs_ppt.append("الفرنسية")
@@ -918,19 +1038,13 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
     success_box = slide.shapes.add_textbox(Inches(6.5), Inches(1.3), Inches(6.3), Inches(5))
     success_frame = success_box.text_frame
     success_frame.word_wrap = True
-    for line in success_analysis.strip().split('\n'):
-        p = success_frame.add_paragraph()
-        p.text = line
-        p.font.size = Pt(24)
-        p.space_after = Pt(10)
-        p.alignment = PP_ALIGN.RIGHT
-        set_paragraph_rtl(p)
+    add_rtl_lines(success_frame, success_analysis.strip().split('\n'), Pt(24), space_after=Pt(10))
     
     # Language Proficiency Gap Slide - Slide 12
     slide = add_content_slide(prs, "🌐 فجوة الكفاءة اللغوية", 12)
-    arabic_avg_ppt = data_df['اللغة العربية'].dropna().mean() if 'اللغة العربية' in data_df.columns else 0
-    french_avg_ppt = data_df['اللغة الفرنسية'].dropna().mean() if 'اللغة الفرنسية' in data_df.columns else 0
-    english_avg_ppt = data_df['اللغة الإنجليزية'].dropna().mean() if 'اللغة الإنجليزية' in data_df.columns else 0
+    arabic_avg_ppt = subject_means.get('اللغة العربية', np.nan) if 'اللغة العربية' in subjects_present else 0
+    french_avg_ppt = subject_means.get('اللغة الفرنسية', np.nan) if 'اللغة الفرنسية' in subjects_present else 0
+    english_avg_ppt = subject_means.get('اللغة الإنجليزية', np.nan) if 'اللغة الإنجليزية' in subjects_present else 0
     foreign_avg_ppt = np.mean([french_avg_ppt, english_avg_ppt]) if (french_avg_ppt > 0 or english_avg_ppt > 0) else 0
     proficiency_gap_ppt = arabic_avg_ppt - foreign_avg_ppt
     lang_text = f"🇲🇦 اللغة العربية (اللغة الأم): {arabic_avg_ppt:.2f}\n🇫🇷 اللغة الفرنسية: {french_avg_ppt:.2f}\n🇬🇧 الإنجليزية: {english_avg_ppt:.2f}\n📊 فجوة الكفاءة (العربية - الأجنبية): {proficiency_gap_ppt:.2f}"
@@ -940,126 +1054,133 @@ def generate_slides_for_data(prs, data_df, subject_columns, selected_classes_ppt
     lang_box = slide.shapes.add_textbox(Inches(6.5), Inches(1.3), Inches(6.3), Inches(5))
     lang_frame = lang_box.text_frame
     lang_frame.word_wrap = True
-    for line in lang_text.strip().split('\n'):
-        p = lang_frame.add_paragraph()
-        p.text = line
-        p.font.size, p.alignment, p.space_after = Pt(22), PP_ALIGN.RIGHT, Pt(8)
-        set_paragraph_rtl(p)
-    lang_df_ppt = pd.DataFrame({fix_arabic('اللغة'): [fix_arabic('العربية'), fix_arabic('الفرنسية'), fix_arabic('الإنجليزية')], fix_arabic('المتوسط'): [arabic_avg_ppt, french_avg_ppt, english_avg_ppt], fix_arabic('النوع'): [fix_arabic('اللغة الأم'), fix_arabic('لغة أجنبية'), fix_arabic('لغة أجنبية')]})
-    fig_lang = px.bar(lang_df_ppt, x=fix_arabic('اللغة'), y=fix_arabic('المتوسط'), color=fix_arabic('النوع'), color_discrete_map={fix_arabic('اللغة الأم'): '#00CC96', fix_arabic('لغة أجنبية'): '#EF553B'}, text=fix_arabic('المتوسط'))
-    fig_lang.update_traces(texttemplate='%{text:.2f}', textposition='outside')
-    fig_lang.update_layout(height=400, width=500, showlegend=True, xaxis_title=fix_arabic("اللغة"), yaxis_title=fix_arabic("المتوسط"))
-    fig_lang.add_hline(y=10, line_dash="dash", line_color="gray")
-    img_stream = fig_to_image(fig_lang)
-    if img_stream: slide.shapes.add_picture(img_stream, Inches(0.5), Inches(1.3), width=Inches(6))
+    add_rtl_lines(lang_frame, lang_text.strip().split('\n'), Pt(22), space_after=Pt(8))
+    native_color, foreign_color = LANGUAGE_TYPE_COLORS.values()
+    fig_lang = bar_figure_mpl(LANGUAGE_LABELS, [arabic_avg_ppt, french_avg_ppt, english_avg_ppt], [native_color, foreign_color, foreign_color],
+                              xlabel=LABEL_LANGUAGE, ylabel=LABEL_MEAN, hline=10, hline_color="gray", legend=LANGUAGE_TYPE_COLORS)
+    chart_jobs.append((slide, fig_lang, (Inches(0.5), Inches(1.3), Inches(6))))
 
     # ====== LANGUAGE GAP DISTRIBUTION SLIDE ====== Slide 13
     slide = add_content_slide(prs, "📊 توزيع الفجوة اللغوية", 13)
-    student_gap_ppt = []
-    for idx, row in data_df.iterrows():
-        arabic_score = row.get('اللغة العربية', np.nan)
-        foreign_scores = [row.get(col, np.nan) for col in ['اللغة الفرنسية', 'اللغة الإنجليزية'] if col in data_df.columns]
-        foreign_scores = [s for s in foreign_scores if pd.notna(s)]
-        if pd.notna(arabic_score) and foreign_scores:
-            student_gap_ppt.append(arabic_score - (sum(foreign_scores) / len(foreign_scores)))
-    if student_gap_ppt:
-        valid_gaps_ppt = [g for g in student_gap_ppt if pd.notna(g)]
-        if valid_gaps_ppt:
-            pos_gap = sum(1 for g in valid_gaps_ppt if g > 1)
-            neg_gap = sum(1 for g in valid_gaps_ppt if g < -1)
-            balanced = len(valid_gaps_ppt) - pos_gap - neg_gap
-            fig_gap_hist = px.histogram(pd.DataFrame({fix_arabic('الفجوة'): valid_gaps_ppt}), x=fix_arabic('الفجوة'), nbins=20, color_discrete_sequence=['#636EFA'])
-            fig_gap_hist.add_vline(x=0, line_dash="dash", line_color="red", annotation_text=fix_arabic("توازن"))
-            fig_gap_hist.update_layout(title=fix_arabic("توزيع الفجوة اللغوية"), height=400, width=550, xaxis_title=fix_arabic("الفجوة"), yaxis_title=fix_arabic("عدد التلاميذ"))
-            img_stream_gap = fig_to_image(fig_gap_hist)
-            if img_stream_gap: slide.shapes.add_picture(img_stream_gap, Inches(0.3), Inches(1.3), width=Inches(6.2))
-            gap_analysis = f"📊 تحليل الفجوة اللغوية:\n\n📈 أفضل في العربية: {pos_gap} تلميذ ({pos_gap/len(valid_gaps_ppt)*100:.1f}%)\n⚖️ متوازن: {balanced} تلميذ ({balanced/len(valid_gaps_ppt)*100:.1f}%)\n🌍 أفضل في الأجنبية: {neg_gap} تلميذ ({neg_gap/len(valid_gaps_ppt)*100:.1f}%)\n\n"
-            avg_gap = sum(valid_gaps_ppt) / len(valid_gaps_ppt)
-            if avg_gap > 1: gap_analysis += "⚠️ غالبية التلاميذ يحتاجون دعماً في اللغات الأجنبية"
-            elif avg_gap < -1: gap_analysis += "🌟 غالبية التلاميذ متفوقون في اللغات الأجنبية"
-            else: gap_analysis += "✅ توزيع متوازن للكفاءة اللغوية"
-            gap_box = slide.shapes.add_textbox(Inches(6.5), Inches(1.3), Inches(6.3), Inches(5))
-            gap_frame = gap_box.text_frame
-            gap_frame.word_wrap = True
-            for line in gap_analysis.strip().split('\n'):
-                p = gap_frame.add_paragraph()
-                p.text = line
-                p.font.size, p.alignment, p.space_after = Pt(22), PP_ALIGN.RIGHT, Pt(8)
-                set_paragraph_rtl(p)
+    foreign_cols_ppt = [col for col in ['اللغة الفرنسية', 'اللغة الإنجليزية'] if col in subjects_present]
+    if 'اللغة العربية' in subjects_present and foreign_cols_ppt:
+        # Row mean skips a missing foreign grade, like averaging only the grades present
+        gaps_ppt = (data_df['اللغة العربية'] - data_df[foreign_cols_ppt].mean(axis=1)).dropna()
+    else:
+        gaps_ppt = pd.Series(dtype=float)
+    if len(gaps_ppt) > 0:
+        pos_gap = int((gaps_ppt > 1).sum())
+        neg_gap = int((gaps_ppt < -1).sum())
+        balanced = len(gaps_ppt) - pos_gap - neg_gap
+        fig_gap_hist = gap_hist_figure_mpl(gaps_ppt.values)
+        chart_jobs.append((slide, fig_gap_hist, (Inches(0.3), Inches(1.3), Inches(6.2))))
+        gap_analysis = f"📊 تحليل الفجوة اللغوية:\n\n📈 أفضل في العربية: {pos_gap} تلميذ ({pos_gap/len(gaps_ppt)*100:.1f}%)\n⚖️ متوازن: {balanced} تلميذ ({balanced/len(gaps_ppt)*100:.1f}%)\n🌍 أفضل في الأجنبية: {neg_gap} تلميذ ({neg_gap/len(gaps_ppt)*100:.1f}%)\n\n"
+        avg_gap = gaps_ppt.mean()
+        if avg_gap > 1: gap_analysis += "⚠️ غالبية التلاميذ يحتاجون دعماً في اللغات الأجنبية"
+        elif avg_gap < -1: gap_analysis += "🌟 غالبية التلاميذ متفوقون في اللغات الأجنبية"
+        else: gap_analysis += "✅ توزيع متوازن للكفاءة اللغوية"
+        gap_box = slide.shapes.add_textbox(Inches(6.5), Inches(1.3), Inches(6.3), Inches(5))
+        gap_frame = gap_box.text_frame
+        gap_frame.word_wrap = True
+        add_rtl_lines(gap_frame, gap_analysis.strip().split('\n'), Pt(22), space_after=Pt(8))
 
     # Correlation Analysis Slide - Slide 14
     slide = add_content_slide(prs, "🔗 تحليل الارتباط بين المواد", 14)
-    corr_subjects = [col for col in subject_columns if col in data_df.columns and col != 'المعدل']
+    corr_subjects = [col for col in subjects_present if col != 'المعدل']
     corr_data = data_df[corr_subjects].dropna()
     if len(corr_data) > 5 and len(corr_subjects) > 1:
         corr_matrix = corr_data.corr()
-        correlations = []
-        for i in range(len(corr_subjects)):
-            for j in range(i + 1, len(corr_subjects)):
-                correlations.append({'المادة 1': corr_subjects[i], 'المادة 2': corr_subjects[j], 'الارتباط': corr_matrix.iloc[i, j]})
-        corr_df = pd.DataFrame(correlations).sort_values('الارتباط', ascending=False, key=abs)
-        avg_corr = corr_df['الارتباط'].mean()
-        strongest = corr_df.iloc[0] if len(corr_df) > 0 else None
+        # Each subject pair once, from the upper triangle of the matrix
+        pair_i, pair_j = np.triu_indices(len(corr_subjects), k=1)
+        pair_corrs = corr_matrix.values[pair_i, pair_j]
+        # A constant subject has NaN correlations, which the average and the strongest pair skip
+        has_corr = not np.isnan(pair_corrs).all()
+        avg_corr = np.nanmean(pair_corrs) if has_corr else np.nan
+        best = np.nanargmax(np.abs(pair_corrs)) if has_corr else 0
+        strongest = (corr_subjects[pair_i[best]], corr_subjects[pair_j[best]], pair_corrs[best])
         avg_color = RGBColor(22, 163, 74) if avg_corr >= 0.5 else (RGBColor(202, 138, 4) if avg_corr >= 0.3 else RGBColor(220, 38, 38))
         avg_bg = RGBColor(220, 252, 231) if avg_corr >= 0.5 else (RGBColor(254, 249, 195) if avg_corr >= 0.3 else RGBColor(254, 226, 226))
         add_corr_card(slide, 6.7, 1.2, 6, 1.0, "📊", "متوسط الارتباط العام", "قياس العلاقة بين جميع المواد", f"{avg_corr:.2f}", avg_bg, avg_color)
-        if strongest is not None:
-            add_corr_card(slide, 6.7, 2.3, 6, 1.0, "🔗", "أقوى ارتباط", f"{strongest['المادة 1']} ↔ {strongest['المادة 2']}", f"معامل الارتباط: {strongest['الارتباط']:.2f}", RGBColor(219, 234, 254), RGBColor(37, 99, 235))
-        fig_corr = px.imshow(corr_matrix, labels=dict(x=fix_arabic("المادة"), y=fix_arabic("المادة"), color=fix_arabic("الارتباط")), x=[fix_arabic(s) for s in corr_subjects], y=[fix_arabic(s) for s in corr_subjects], color_continuous_scale='RdBu_r', zmin=-1, zmax=1, text_auto='.2f')
-        fig_corr.update_layout(height=800, width=900, margin=dict(t=20, b=60, l=60, r=40), font=dict(size=14))
-        img_stream = fig_to_image(fig_corr)
-        if img_stream: slide.shapes.add_picture(img_stream, Inches(0.2), Inches(1.1), width=Inches(6.3))
+        add_corr_card(slide, 6.7, 2.3, 6, 1.0, "🔗", "أقوى ارتباط", f"{strongest[0]} ↔ {strongest[1]}", f"معامل الارتباط: {strongest[2]:.2f}", RGBColor(219, 234, 254), RGBColor(37, 99, 235))
+        fig_corr = corr_heatmap_figure_mpl(corr_matrix.values, [subject_labels[s] for s in corr_subjects])
+        chart_jobs.append((slide, fig_corr, (Inches(0.2), Inches(1.1), Inches(6.3))))
 
     # At-Risk Students Slide - Slide 15
     slide = add_content_slide(prs, "🚨 التلاميذ المعرضين للخطر", 15)
-    at_risk = data_df[data_df['المعدل'] < 9]
-    borderline = data_df[(data_df['المعدل'] >= 9) & (data_df['المعدل'] < 10)]
-    excellent = data_df[data_df['المعدل'] >= data_df['المعدل'].mean() + 1.5 * data_df['المعدل'].std()]
-    risk_text = f"🔴 معرضون للخطر (معدل < 9): {len(at_risk)} تلاميذ\n🟡 على الحافة (معدل 9-10): {len(borderline)} تلاميذ\n⭐ متميزون جداً: {len(excellent)} تلاميذ"
+    # Counts straight from the slide-1 grade array (NaN compares False, so missing grades count nowhere)
+    at_risk = np.flatnonzero(all_grades < 9)
+    n_borderline = int(((all_grades >= 9) & (all_grades < 10)).sum())
+    n_excellent = int((all_grades >= avg_grade + 1.5 * std_grade).sum())
+    risk_text = f"🔴 معرضون للخطر (معدل < 9): {len(at_risk)} تلاميذ\n🟡 على الحافة (معدل 9-10): {n_borderline} تلاميذ\n⭐ متميزون جداً: {n_excellent} تلاميذ"
     risk_box = slide.shapes.add_textbox(Inches(6.5), Inches(1.3), Inches(6.3), Inches(4))
     risk_frame = risk_box.text_frame
     risk_frame.word_wrap = True
-    for line in risk_text.strip().split('\n'):
-        p = risk_frame.add_paragraph()
-        p.text = line
-        p.font.size, p.alignment, p.space_after = Pt(22), PP_ALIGN.RIGHT, Pt(8)
-        set_paragraph_rtl(p)
+    add_rtl_lines(risk_frame, risk_text.strip().split('\n'), Pt(22), space_after=Pt(8))
     if len(at_risk) > 0:
-        names = at_risk.nsmallest(5, 'المعدل')[['اسم التلميذ', 'المعدل']]
+        names = at_risk[np.argsort(all_grades[at_risk], kind='stable')[:5]]
         names_text = "📋 أسماء التلاميذ الأكثر خطراً:\n"
-        for _, r in names.iterrows(): names_text += f"• {r['اسم التلميذ']}: {r['المعدل']:.2f}\n"
+        for name, avg in zip(student_names[names], all_grades[names]): names_text += f"• {name}: {avg:.2f}\n"
         nf = slide.shapes.add_textbox(Inches(0.5), Inches(1.3), Inches(6), Inches(4)).text_frame
-        for line in names_text.strip().split('\n'):
-            p = nf.add_paragraph()
-            p.text = line
-            p.font.size, p.alignment, p.space_after = Pt(20), PP_ALIGN.RIGHT, Pt(6)
-            set_paragraph_rtl(p)
+        add_rtl_lines(nf, names_text.strip().split('\n'), Pt(20), space_after=Pt(6))
 
     # Final Recommendations Slide - Slide 16
     slide = add_content_slide(prs, "💡 التوصيات والخلاصة", 16)
     rec_text = "📌 التوصيات الرئيسية:\n"
     if len(at_risk) > 0: rec_text += f"🔴 تدخل عاجل: {len(at_risk)} تلاميذ يحتاجون دعماً مكثفاً\n"
-    if len(borderline) > 0: rec_text += f"🟡 متابعة دقيقة: {len(borderline)} تلاميذ على حافة الرسوب\n"
-    if len(excellent) > 0: rec_text += f"⭐ متميزون: {len(excellent)} تلاميذ يمكنهم المساعدة\n"
-    rec_text += f"\n📊 ملخص الأداء:\n• نسبة النجاح: {pass_rate:.1f}%\n• نسبة التميز: {excellent_rate:.1f}%\n• المعدل العام: {data_df['المعدل'].mean():.2f}"
+    if n_borderline > 0: rec_text += f"🟡 متابعة دقيقة: {n_borderline} تلاميذ على حافة الرسوب\n"
+    if n_excellent > 0: rec_text += f"⭐ متميزون: {n_excellent} تلاميذ يمكنهم المساعدة\n"
+    rec_text += f"\n📊 ملخص الأداء:\n• نسبة النجاح: {pass_rate:.1f}%\n• نسبة التميز: {excellent_rate:.1f}%\n• المعدل العام: {avg_grade:.2f}"
     rec_box = slide.shapes.add_textbox(Inches(0.5), Inches(1.4), Inches(12), Inches(5.5))
     rec_frame = rec_box.text_frame
     rec_frame.word_wrap = True
-    for line in rec_text.strip().split('\n'):
-        p = rec_frame.add_paragraph()
-        p.text = line
-        p.font.size, p.alignment, p.space_after = Pt(22), PP_ALIGN.RIGHT, Pt(8)
-        set_paragraph_rtl(p)
+    add_rtl_lines(rec_frame, rec_text.strip().split('\n'), Pt(22), space_after=Pt(8))
+
+    add_chart_images(chart_jobs)
 
     # Thank You Slide
     s = prs.slides.add_slide(prs.slide_layouts[6])
     add_gradient_background(s, RGBColor(0, 100, 80), RGBColor(25, 55, 95))
-    tp = s.shapes.add_textbox(Inches(0.5), Inches(3), Inches(12.333), Inches(1.2)).text_frame.paragraphs[0]
-    tp.text = "شكراً لكم!"
-    tp.font.size, tp.font.bold, tp.font.color.rgb, tp.alignment = Pt(60), True, RGBColor(255,255,255), PP_ALIGN.CENTER
-    set_paragraph_rtl(tp)
+    add_text(s, Inches(0.5), Inches(3), Inches(12.333), Inches(1.2), "شكراً لكم!", Pt(60), bold=True, color=RGBColor(255,255,255))
 
 # ============ GENDER DETECTION FUNCTION ============
+# Common Moroccan/Arabic female names
+FEMALE_NAMES = frozenset({
+    # Names ending with typical female suffixes
+    'فاطمة', 'عائشة', 'خديجة', 'مريم', 'زينب', 'أمينة', 'حليمة', 'رقية', 'سعاد', 'نادية',
+    'سميرة', 'نجاة', 'لطيفة', 'حسناء', 'سناء', 'هناء', 'دعاء', 'آسية', 'سارة', 'ليلى',
+    'نعيمة', 'كريمة', 'رحيمة', 'فتيحة', 'صفية', 'سلمى', 'هدى', 'منى', 'سهام', 'إيمان',
+    'سكينة', 'حنان', 'غيثة', 'رجاء', 'وفاء', 'صباح', 'نوال', 'سعيدة', 'جميلة', 'نبيلة',
+    'عزيزة', 'حفيظة', 'رشيدة', 'مليكة', 'خولة', 'أسماء', 'بشرى', 'إكرام', 'ابتسام', 'انتصار',
+    'سمية', 'علية', 'زهرة', 'ياسمين', 'نسرين', 'شيماء', 'إسراء', 'آية', 'مروة', 'هاجر',
+    'سلوى', 'لبنى', 'رانيا', 'دنيا', 'نهى', 'نورة', 'نور', 'سهى', 'ندى', 'هبة', 'لينا',
+    'ريم', 'رنا', 'دينا', 'منار', 'ملاك', 'جنة', 'روان', 'تسنيم', 'سجى', 'وئام', 'نجوى',
+    'توفيقة', 'مباركة', 'عتيقة', 'يامنة', 'فضيلة', 'زهور', 'بديعة', 'نزهة', 'حورية', 'سعدية',
+    'فوزية', 'زكية', 'تركية', 'خيرة', 'عيشة', 'للا', 'أم', 'فاطنة', 'رحمة', 'بركة',
+    'إلهام', 'سهيلة', 'نسيمة', 'وسيلة', 'جليلة', 'وردة', 'زوليخة', 'حادة', 'فضمة', 'يطو',
+    'إيناس', 'أميمة', 'هند', 'علا', 'رباب', 'شروق', 'غادة', 'لمياء', 'مها', 'ميساء'
+})
+
+# Common Moroccan/Arabic male names
+MALE_NAMES = frozenset({
+    'محمد', 'أحمد', 'عبدالله', 'عبد', 'علي', 'حسن', 'حسين', 'عمر', 'خالد', 'يوسف',
+    'إبراهيم', 'عثمان', 'سعيد', 'كريم', 'رشيد', 'مصطفى', 'إدريس', 'عزيز', 'حميد', 'مراد',
+    'جمال', 'كمال', 'نبيل', 'سمير', 'منير', 'بشير', 'نصير', 'زهير', 'طارق', 'فاروق',
+    'صلاح', 'جلال', 'بلال', 'عادل', 'فيصل', 'نوفل', 'جواد', 'فؤاد', 'عماد', 'زياد',
+    'أيمن', 'أنس', 'إياد', 'رياض', 'عياض', 'معاذ', 'براء', 'همام', 'هشام', 'وسام',
+    'ياسر', 'ناصر', 'منصور', 'عاشور', 'نور الدين', 'صلاح الدين', 'عز الدين', 'بدر الدين',
+    'عبدالرحمن', 'عبدالكريم', 'عبدالحق', 'عبدالصمد', 'عبدالعزيز', 'عبدالرحيم', 'عبدالغني',
+    'الحسن', 'الحسين', 'المهدي', 'المصطفى', 'الطيب', 'المختار', 'المنصور', 'الشريف',
+    'أمين', 'رضوان', 'سفيان', 'عدنان', 'سليمان', 'رمضان', 'شعبان', 'مروان', 'عثمان',
+    'حمزة', 'طه', 'يحيى', 'زكريا', 'آدم', 'نوح', 'موسى', 'عيسى', 'داوود', 'سليم',
+    'وليد', 'ماجد', 'راشد', 'حامد', 'أسامة', 'قاسم', 'باسم', 'هاشم', 'عصام', 'حسام',
+    'فهد', 'سعد', 'فارس', 'أيوب', 'يونس', 'إلياس', 'درويش', 'مبارك', 'ميمون', 'لحسن',
+    'بوشعيب', 'العربي', 'الطاهر', 'الصديق', 'عبدو', 'حدو', 'بوزيد', 'مولاي', 'سيدي'
+})
+
+MALE_PREFIXES = ('عبد', 'أبو', 'بو', 'سي', 'مولاي', 'سيدي')
+# Common female name endings in Arabic
+FEMALE_ENDINGS = ('ة', 'اء', 'ى', 'ية')
+
 @st.cache_data
 def detect_gender(name):
     """
@@ -1069,73 +1190,57 @@ def detect_gender(name):
     if pd.isna(name) or not isinstance(name, str):
         return 'U'
     
-    # Extract first name (first word)
-    first_name = name.strip().split()[0] if name.strip() else ''
-    first_name = first_name.strip()
-    
-    # Common Moroccan/Arabic female names
-    female_names = {
-        # Names ending with typical female suffixes
-        'فاطمة', 'عائشة', 'خديجة', 'مريم', 'زينب', 'أمينة', 'حليمة', 'رقية', 'سعاد', 'نادية',
-        'سميرة', 'نجاة', 'لطيفة', 'حسناء', 'سناء', 'هناء', 'دعاء', 'آسية', 'سارة', 'ليلى',
-        'نعيمة', 'كريمة', 'رحيمة', 'فتيحة', 'صفية', 'سلمى', 'هدى', 'منى', 'سهام', 'إيمان',
-        'سكينة', 'حنان', 'غيثة', 'رجاء', 'وفاء', 'صباح', 'نوال', 'سعيدة', 'جميلة', 'نبيلة',
-        'عزيزة', 'حفيظة', 'رشيدة', 'مليكة', 'خولة', 'أسماء', 'بشرى', 'إكرام', 'ابتسام', 'انتصار',
-        'سمية', 'علية', 'زهرة', 'ياسمين', 'نسرين', 'شيماء', 'إسراء', 'آية', 'مروة', 'هاجر',
-        'سلوى', 'لبنى', 'رانيا', 'دنيا', 'نهى', 'نورة', 'نور', 'سهى', 'ندى', 'هبة', 'لينا',
-        'ريم', 'رنا', 'دينا', 'منار', 'ملاك', 'جنة', 'روان', 'تسنيم', 'سجى', 'وئام', 'نجوى',
-        'توفيقة', 'مباركة', 'عتيقة', 'يامنة', 'فضيلة', 'زهور', 'بديعة', 'نزهة', 'حورية', 'سعدية',
-        'فوزية', 'زكية', 'تركية', 'خيرة', 'عيشة', 'للا', 'أم', 'فاطنة', 'رحمة', 'بركة',
-        'إلهام', 'سهيلة', 'نسيمة', 'وسيلة', 'جليلة', 'وردة', 'زوليخة', 'حادة', 'فضمة', 'يطو',
-        'إيناس', 'أميمة', 'هند', 'علا', 'رباب', 'شروق', 'غادة', 'لمياء', 'مها', 'ميساء'
-    }
-    
-    # Common Moroccan/Arabic male names
-    male_names = {
-        'محمد', 'أحمد', 'عبدالله', 'عبد', 'علي', 'حسن', 'حسين', 'عمر', 'خالد', 'يوسف',
-        'إبراهيم', 'عثمان', 'سعيد', 'كريم', 'رشيد', 'مصطفى', 'إدريس', 'عزيز', 'حميد', 'مراد',
-        'جمال', 'كمال', 'نبيل', 'سمير', 'منير', 'بشير', 'نصير', 'زهير', 'طارق', 'فاروق',
-        'صلاح', 'جلال', 'بلال', 'عادل', 'فيصل', 'نوفل', 'جواد', 'فؤاد', 'عماد', 'زياد',
-        'أيمن', 'أنس', 'إياد', 'رياض', 'عياض', 'معاذ', 'براء', 'همام', 'هشام', 'وسام',
-        'ياسر', 'ناصر', 'منصور', 'عاشور', 'نور الدين', 'صلاح الدين', 'عز الدين', 'بدر الدين',
-        'عبدالرحمن', 'عبدالكريم', 'عبدالحق', 'عبدالصمد', 'عبدالعزيز', 'عبدالرحيم', 'عبدالغني',
-        'الحسن', 'الحسين', 'المهدي', 'المصطفى', 'الطيب', 'المختار', 'المنصور', 'الشريف',
-        'أمين', 'رضوان', 'سفيان', 'عدنان', 'سليمان', 'رمضان', 'شعبان', 'مروان', 'عثمان',
-        'حمزة', 'طه', 'يحيى', 'زكريا', 'آدم', 'نوح', 'موسى', 'عيسى', 'داوود', 'سليم',
-        'وليد', 'ماجد', 'راشد', 'حامد', 'أسامة', 'قاسم', 'باسم', 'هاشم', 'عصام', 'حسام',
-        'فهد', 'سعد', 'فارس', 'أيوب', 'يونس', 'إلياس', 'درويش', 'مبارك', 'ميمون', 'لحسن',
-        'بوشعيب', 'العربي', 'الطاهر', 'الصديق', 'عبدو', 'حدو', 'بوزيد', 'مولاي', 'سيدي'
-    }
+    # Extract first name (first word); split() already drops surrounding whitespace
+    words = name.split()
+    first_name = words[0] if words else ''
     
     # Check exact match first
-    if first_name in female_names:
+    if first_name in FEMALE_NAMES:
         return 'F'
-    if first_name in male_names:
+    if first_name in MALE_NAMES:
         return 'M'
     
     # Check if name starts with common male prefixes
-    male_prefixes = ['عبد', 'أبو', 'بو', 'سي', 'مولاي', 'سيدي']
-    for prefix in male_prefixes:
-        if first_name.startswith(prefix):
-            return 'M'
+    if first_name.startswith(MALE_PREFIXES):
+        return 'M'
     
     # Check endings - common female name endings in Arabic
-    female_endings = ['ة', 'اء', 'ى', 'ية']
-    for ending in female_endings:
-        if first_name.endswith(ending) and len(first_name) > 2:
-            return 'F'
+    if first_name.endswith(FEMALE_ENDINGS) and len(first_name) > 2:
+        return 'F'
     
     # Default to unknown
     return 'U'
 
+def detect_genders(names):
+    """Vectorized detect_gender over a Series of names: same rules, same priority order"""
+    try:
+        first_names = names.str.split().str[0]
+    except AttributeError:
+        # .str refuses a column without any string values
+        return pd.Series('U', index=names.index)
+    # First names repeat a lot: classify each distinct one once, then spread by integer code
+    codes, uniques = pd.factorize(first_names)
+    uniques = pd.Series(uniques)
+    unique_genders = np.select(
+        [
+            uniques.isin(FEMALE_NAMES),
+            uniques.isin(MALE_NAMES),
+            uniques.str.startswith(MALE_PREFIXES, na=False),
+            uniques.str.endswith(FEMALE_ENDINGS, na=False) & (uniques.str.len() > 2),
+        ],
+        ['F', 'M', 'M', 'F'],
+        default='U'
+    )
+    # A missing first name has code -1, which picks the trailing 'U'
+    return pd.Series(np.append(unique_genders, 'U')[codes], index=names.index)
+
 @st.cache_data
 def get_gender_stats(df, name_column='اسم التلميذ'):
     """Calculate gender statistics from a dataframe."""
     if name_column not in df.columns:
         return {'M': 0, 'F': 0, 'U': len(df)}
     
-    df['_gender'] = df[name_column].apply(detect_gender)
-    stats = df['_gender'].value_counts().to_dict()
+    stats = detect_genders(df[name_column]).value_counts().to_dict()
     
     return {
         'M': stats.get('M', 0),
@@ -1143,47 +1248,91 @@ def get_gender_stats(df, name_column='اسم التلميذ'):
         'U': stats.get('U', 0)
     }
 
-@st.cache_data
+# The dashboard's derived tables are a pure function of the workbook and the class filter, so like load_data
+# they persist to disk and a reload of the same workbook skips recomputing them
+@st.cache_data(persist="disk", max_entries=32)
 def calculate_subject_stats(df, subject_columns):
     """Calculate detailed statistics for each subject."""
-    stats_data = []
-    for col in subject_columns:
-        if col in df.columns:
-            valid_data = df[col].dropna()
-            if len(valid_data) > 0:
-                stats_data.append({
-                    'المادة': col,
-                    'المتوسط': valid_data.mean(),
-                    'الأعلى': valid_data.max(),
-                    'الأقل': valid_data.min(),
-                    'الانحراف المعياري': valid_data.std(),
-                    'عدد الطلاب': len(valid_data)
-                })
-    return pd.DataFrame(stats_data)
+    present = [col for col in subject_columns if col in df.columns]
+    if not present:
+        return pd.DataFrame()
+    # One reduction per statistic across all subjects; subjects without any grade are left out
+    stats = df[present].agg(['mean', 'max', 'min', 'std', 'count']).T
+    stats = stats[stats['count'] > 0].astype({'count': int})
+    return stats.rename_axis('المادة').reset_index().rename(columns={
+        'mean': 'المتوسط', 'max': 'الأعلى', 'min': 'الأقل', 'std': 'الانحراف المعياري', 'count': 'عدد الطلاب'
+    })
 
-@st.cache_data
+@st.cache_data(persist="disk", max_entries=32)
+def calculate_subject_box_data(df, subject_columns):
+    """Box-plot statistics per subject: quartiles, Tukey fences and the outlying grades."""
+    present = [col for col in subject_columns if col in df.columns]
+    grades = df[present].to_numpy(dtype=np.float64, na_value=np.nan)
+    graded = (~np.isnan(grades)).any(axis=0)
+    present, grades = [col for col, keep in zip(present, graded) if keep], grades[:, graded]
+    if not present:
+        return pd.DataFrame()
+    # Same linear quartiles and 1.5 IQR whiskers Plotly computes in the browser, done once here
+    q1, median, q3 = np.nanquantile(grades, [0.25, 0.5, 0.75], axis=0)
+    iqr = q3 - q1
+    inside = (grades >= q1 - 1.5 * iqr) & (grades <= q3 + 1.5 * iqr)
+    outside = ~inside & ~np.isnan(grades)
+    return pd.DataFrame({
+        'المادة': present,
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': np.nanmin(np.where(inside, grades, np.nan), axis=0),
+        'upperfence': np.nanmax(np.where(inside, grades, np.nan), axis=0),
+        'outliers': [grades[outside[:, i], i] for i in range(len(present))],
+    })
+
+@st.cache_data(persist="disk", max_entries=32)
 def calculate_student_orientation(df, science_subjects, humanities_subjects):
     """Calculate average scores for science and humanities for each student."""
-    student_science_avg = []
-    student_humanities_avg = []
-    
-    for idx, row in df.iterrows():
-        sci_vals = [row[col] for col in science_subjects if col in df.columns and pd.notna(row.get(col))]
-        hum_vals = [row[col] for col in humanities_subjects if col in df.columns and pd.notna(row.get(col))]
-        
-        student_science_avg.append(np.mean(sci_vals) if sci_vals else np.nan)
-        student_humanities_avg.append(np.mean(hum_vals) if hum_vals else np.nan)
-    
-    return student_science_avg, student_humanities_avg
+    return row_means(df, science_subjects), row_means(df, humanities_subjects)
 
-@st.cache_data
+@st.cache_data(persist="disk", max_entries=32)
 def calculate_enrichment_stats(df, enrichment_subjects):
     """Calculate enrichment scores for each student."""
-    student_enrichment_avg = []
-    for idx, row in df.iterrows():
-        enr_vals = [row[col] for col in enrichment_subjects if col in df.columns and pd.notna(row.get(col))]
-        student_enrichment_avg.append(np.mean(enr_vals) if enr_vals else np.nan)
-    return student_enrichment_avg
+    return row_means(df, enrichment_subjects)
+
+@st.cache_data(persist="disk", max_entries=32)
+def calculate_subject_correlations(grades, subjects):
+    """Correlation matrix over fully graded students and the subject pairs by strength; (None, None) with too little data."""
+    correlation_data = grades[~np.isnan(grades).any(axis=1)]
+    if len(correlation_data) <= 5 or len(subjects) <= 1:
+        return None, None
+    # A subject everyone got the same grade in has no correlation (NaN), as with DataFrame.corr
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr_matrix = pd.DataFrame(np.corrcoef(correlation_data, rowvar=False), index=subjects, columns=subjects)
+    # Upper triangle of the matrix, row by row, to list each pair once
+    first, second = np.triu_indices(len(subjects), k=1)
+    pair_corr = corr_matrix.to_numpy()[first, second]
+    corr_df = pd.DataFrame({
+        'المادة 1': np.asarray(subjects, dtype=object)[first],
+        'المادة 2': np.asarray(subjects, dtype=object)[second],
+        'معامل الارتباط': pair_corr,
+        'قوة الارتباط': np.abs(pair_corr),
+    }).sort_values('قوة الارتباط', ascending=False)
+    return corr_matrix, corr_df
+
+@st.cache_data(persist="disk", max_entries=32)
+def classify_students(df, subject_columns):
+    """Split the students with an average into the at-risk report categories."""
+    avg_mean, avg_std = df['المعدل'].agg(['mean', 'std']).tolist()
+    
+    df_analysis = df[['ر.ت', 'رقم التلميذ', 'اسم التلميذ', 'المعدل'] + [col for col in subject_columns if col != 'المعدل' and col in df.columns]]
+    df_analysis = df_analysis.dropna(subset=['المعدل'])
+    
+    # Band of every average in one binary search: 0 below 9, 1 for 9-10, 2 for 10-11, 3 from 11 up
+    bands = np.searchsorted([9.0, 10.0, 11.0], df_analysis['المعدل'].to_numpy(dtype=np.float64), side='right')
+    borderline_low = df_analysis[bands == 1]
+    borderline_high = df_analysis[bands == 2]
+    at_risk = df_analysis[bands == 0]
+    excellent = df_analysis[df_analysis['المعدل'] >= avg_mean + 1.5 * avg_std]
+    outliers_top = df_analysis[df_analysis['المعدل'] >= avg_mean + 2 * avg_std]
+    return avg_mean, avg_std, df_analysis, borderline_low, borderline_high, at_risk, excellent, outliers_top
 
 # File uploader in sidebar
 st.sidebar.header("📁 تحميل الملف")
@@ -1214,27 +1363,103 @@ st.title(f"📊 {app_title}")
 st.markdown("---")
 
 # Load data
-@st.cache_data
-def load_data(file_content, file_name):
-    xls = pd.ExcelFile(io.BytesIO(file_content))
+# ============ DASHBOARD CHART HELPERS ============
+def reference_line(axis, value, color, text=None):
+    """Layout shapes/annotations equal to fig.add_hline/add_vline, for building a figure in one call"""
+    if axis == 'h':
+        shape = dict(type='line', xref='x domain', x0=0, x1=1, yref='y', y0=value, y1=value, line=dict(color=color, dash='dash'))
+        label = dict(text=text, showarrow=False, xref='x domain', x=1, xanchor='right', yref='y', y=value, yanchor='bottom')
+    else:
+        shape = dict(type='line', xref='x', x0=value, x1=value, yref='y domain', y0=0, y1=1, line=dict(color=color, dash='dash'))
+        label = dict(text=text, showarrow=False, xref='x', x=value, xanchor='left', yref='y domain', y=1, yanchor='top')
+    return dict(shapes=[shape], annotations=[label] if text else [])
+
+def histogram_bars(values, bins=20, color='#636EFA'):
+    """Histogram binned here with np.histogram, so the browser gets the bin counts instead of every value"""
+    counts, edges = np.histogram(values, bins=bins)
+    return go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), marker_color=color)
+
+# The language-section figures depend only on a few aggregates, so they are built once per distinct
+# set of values and shared across reruns and sessions (st.plotly_chart serialises them without mutating)
+@st.cache_resource(max_entries=32)
+def language_bar_figure(arabic_avg, french_avg, english_avg):
+    """Class average per language; one trace per language type so the legend tells the mother tongue from the foreign languages"""
+    return go.Figure(
+        data=[go.Bar(x=['🇲🇦 العربية'], y=[arabic_avg], name='اللغة الأم', marker_color='#00CC96',
+                     text=[arabic_avg], texttemplate='%{text:.2f}', textposition='outside'),
+              go.Bar(x=['🇫🇷 الفرنسية', '🇬🇧 الإنجليزية'], y=[french_avg, english_avg], name='لغة أجنبية', marker_color='#EF553B',
+                     text=[french_avg, english_avg], texttemplate='%{text:.2f}', textposition='outside')],
+        layout=dict(height=400, showlegend=True, title="مقارنة الأداء اللغوي", barmode='relative', legend_title_text='النوع',
+                    xaxis_title='اللغة', yaxis_title='المتوسط', **reference_line('h', 10, 'gray', 'معدل النجاح'))
+    )
+
+@st.cache_resource(max_entries=32)
+def language_radar_figure(arabic_avg, french_avg, english_avg):
+    """Radar of the language averages against the passing grade"""
+    categories = ['العربية', 'الفرنسية', 'الإنجليزية']
+    return go.Figure(
+        data=[go.Scatterpolar(r=[arabic_avg, french_avg, english_avg], theta=categories, fill='toself',
+                              name='المتوسط الفعلي', line_color='#636EFA'),
+              # Reference line for passing grade
+              go.Scatterpolar(r=[10, 10, 10], theta=categories, fill='toself',
+                              name='معدل النجاح', line_color='#00CC96', opacity=0.3)],
+        layout=dict(polar=dict(radialaxis=dict(visible=True, range=[0, 20])), showlegend=True,
+                    title="مخطط الكفاءة اللغوية", height=400)
+    )
+
+@st.cache_resource(max_entries=32)
+def language_gap_histogram(gaps):
+    """Distribution of the per-student Arabic minus foreign-language gaps"""
+    return go.Figure(
+        data=[histogram_bars(gaps)],
+        layout=dict(
+            title="توزيع الفجوة اللغوية (العربية - اللغات الأجنبية)",
+            xaxis_title="الفجوة (قيم موجبة = أفضل في العربية)",
+            yaxis_title="عدد التلاميذ",
+            height=350,
+            bargap=0,
+            **reference_line('v', 0, 'red', 'توازن')
+        )
+    )
+
+@st.cache_resource(max_entries=32)
+def language_pass_figure(lang_pass):
+    """Pass rate per language, coloured on a red-to-green scale"""
+    return go.Figure(
+        data=[go.Bar(x=['العربية', 'الفرنسية', 'الإنجليزية'], y=list(lang_pass),
+                     marker=dict(color=list(lang_pass), colorscale='RdYlGn', showscale=True, colorbar=dict(title='نسبة النجاح %')),
+                     text=list(lang_pass), texttemplate='%{text:.1f}%', textposition='outside')],
+        layout=dict(height=300, title="نسبة النجاح في كل لغة", xaxis_title='اللغة', yaxis_title='نسبة النجاح %')
+    )
+
+# Persisted to disk so a restarted server skips re-parsing a workbook it has already seen
+# The workbook bytes are keyed by a short blake2b digest rather than Streamlit's default hashing of the whole blob
+@st.cache_data(persist="disk", max_entries=8, show_spinner="جاري قراءة ملف Excel...",
+               hash_funcs={bytes: lambda b: hashlib.blake2b(b, digest_size=16).digest()})
+def load_data(file_content, file_name, grade_columns):
+    xls = pd.ExcelFile(io.BytesIO(file_content), engine=EXCEL_ENGINE)
     sheet_names = xls.sheet_names
     
     # Filter out the first sheet if it's just a summary
     data_sheets = [s for s in sheet_names if s not in ['ExportMoGenNoteCcParMatie']]
     
-    all_data = []
-    for sheet in data_sheets:
-        df = pd.read_excel(io.BytesIO(file_content), sheet_name=sheet, header=7)
-        df['الفصل'] = sheet  # Add class name
-        all_data.append(df)
+    # Every sheet is read from the workbook opened above instead of re-opening the file per sheet
+    sheets = pd.read_excel(xls, sheet_name=data_sheets, header=7)
     
-    return pd.concat(all_data, ignore_index=True)
-
-# Load the data
-file_content = uploaded_file.read()
-df = load_data(file_content, uploaded_file.name)
+    # One concat, then the class name column for all rows at once rather than one insert per sheet;
+    # stored as a categorical so class filters compare integer codes instead of strings
+    df = pd.concat(sheets.values(), ignore_index=True)
+    df['الفصل'] = pd.Categorical.from_codes(  # Add class name
+        np.repeat(np.arange(len(sheets)), [len(sheet_df) for sheet_df in sheets.values()]),
+        categories=list(sheets))
+    
+    # Convert grades from string (with commas) to float, once per workbook rather than on every rerun;
+    # a column Excel already stored as numbers needs no string round trip
+    text_grade_columns = [col for col in grade_columns if col in df.columns and not pd.api.types.is_numeric_dtype(df[col])]
+    for col in text_grade_columns:
+        df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    return df
 
-# Convert grades from string (with commas) to float
 subject_columns = [
     'اللغة العربية', 'اللغة الفرنسية', 'اللغة الإنجليزية',
     'الاجتماعيات', 'الرياضيات', 'علوم الحياة والأرض',
@@ -1242,25 +1467,27 @@ subject_columns = [
     'المعلوميات', 'التربية التشكيلية', 'التربية الموسيقية', 'المعدل'
 ]
 
-for col in subject_columns:
-    if col in df.columns:
-        df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.'), errors='coerce')
+# Load the data
+file_content = uploaded_file.read()
+df = load_data(file_content, uploaded_file.name, subject_columns)
 
 # Sidebar for filtering
 st.sidebar.markdown("---")
 st.sidebar.header("🔍 خيارات التصفية")
 if 'الفصل' in df.columns:
-    classes = ['جميع الفصول'] + list(df['الفصل'].unique())
+    # The class column is categorical: its categories are the sheet names, and a class is picked by its code
+    class_names = df['الفصل'].cat.categories
+    classes = ['جميع الفصول', *class_names]
     selected_class = st.sidebar.selectbox("اختر الفصل:", classes)
     if selected_class == 'جميع الفصول':
-        df_filtered = df.copy()
+        df_filtered = df
     else:
-        df_filtered = df[df['الفصل'] == selected_class].copy()
+        df_filtered = df[df['الفصل'].cat.codes == class_names.get_loc(selected_class)]
 else:
-    df_filtered = df.copy()
+    df_filtered = df
 
-# Remove rows with NaN in اسم التلميذ
-df_filtered = df_filtered.dropna(subset=['اسم التلميذ'])
+# Remove rows with NaN in اسم التلميذ; one copy, since columns are added below and the cached frame must stay untouched
+df_filtered = df_filtered.dropna(subset=['اسم التلميذ']).copy()
 
 # Overall Statistics
 st.header("📈 الإحصائيات العامة")
@@ -1290,59 +1517,69 @@ st.markdown("""
 **نظرة سريعة:** جدول يعرض التلاميذ المتفوقين والمتأخرين مع نقاط قوتهم وضعفهم الرئيسية.
 """)
 
-# Function to analyze student strengths and weaknesses
-def analyze_student(row, subject_cols):
-    scores = {}
-    for col in subject_cols:
-        if col != 'المعدل' and col in row.index and pd.notna(row.get(col)):
-            scores[col] = row[col]
-    
-    if not scores:
-        return "—", "—"
-    
-    sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    
-    # Best subject
-    best_subj, best_score = sorted_scores[0]
-    
-    # Worst subject
-    worst_subj, worst_score = sorted_scores[-1]
-    
-    # Generate strength description
-    if best_score >= 18:
-        strength = f"متميز في {best_subj} ({best_score:.2f})"
-    elif best_score >= 15:
-        strength = f"قوي في {best_subj} ({best_score:.2f})"
-    else:
-        strength = f"أفضل مادة: {best_subj} ({best_score:.2f})"
-    
-    # Check if struggling
-    if worst_score < 10:
-        strength += f" | يعاني في {worst_subj} ({worst_score:.2f})"
-    
-    return strength, worst_subj
-
-# Get subject columns for analysis
+# Per-student strengths and weaknesses, read off a (students, subjects) grade matrix
+def grade_extremes(scores):
+    """Column index of each row's highest and lowest grade, first and last among ties, skipping NaN"""
+    if scores.shape[1] == 0:
+        none = np.zeros(len(scores), dtype=np.intp)
+        return none, none, none, none
+    missing = np.isnan(scores)
+    high = np.where(missing, -np.inf, scores)
+    low = np.where(missing, np.inf, scores)
+    last = scores.shape[1] - 1
+    return high.argmax(axis=1), last - high[:, ::-1].argmax(axis=1), low.argmin(axis=1), last - low[:, ::-1].argmin(axis=1)
+
+def strength_texts(scores, subject_cols):
+    """Best subject graded by level, plus the worst one when it is failed"""
+    graded = ~np.isnan(scores).all(axis=1)
+    first_max, _, _, last_min = grade_extremes(scores)
+    texts = []
+    for row, has_grades, best, worst in zip(scores, graded, first_max, last_min):
+        if not has_grades:
+            texts.append("—")
+            continue
+        best_subj, best_score = subject_cols[best], row[best]
+        if best_score >= 18:
+            strength = f"متميز في {best_subj} ({best_score:.2f})"
+        elif best_score >= 15:
+            strength = f"قوي في {best_subj} ({best_score:.2f})"
+        else:
+            strength = f"أفضل مادة: {best_subj} ({best_score:.2f})"
+        if row[worst] < 10:
+            strength += f" | يعاني في {subject_cols[worst]} ({row[worst]:.2f})"
+        texts.append(strength)
+    return texts
+
+# Get subject columns for analysis, and their grades as one (students, subjects) matrix shared by the
+# rankings, the correlation analysis and the failure report below
 analysis_subject_cols = [col for col in subject_columns if col in df_filtered.columns and col != 'المعدل']
+analysis_grades = df_filtered[analysis_subject_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+
+# Rank the averages once for the top and bottom tables; missing averages are left out.
+# Stable sorts rank tied averages by row order, like nlargest/nsmallest with keep='first'
+filtered_grades = df_filtered['المعدل'].to_numpy(dtype=np.float64, na_value=np.nan)
+graded_rows = np.flatnonzero(~np.isnan(filtered_grades))
+top_order = graded_rows[np.argsort(-filtered_grades[graded_rows], kind='stable')]
+bottom_order = graded_rows[np.argsort(filtered_grades[graded_rows], kind='stable')]
 
 # Create top performers table
 st.markdown("### 🥇 أفضل التلاميذ")
 
-top_students = df_filtered.nlargest(5, 'المعدل')[['ر.ت', 'اسم التلميذ', 'المعدل'] + analysis_subject_cols].copy()
-top_students = top_students.loc[:, ~top_students.columns.duplicated()]  # Remove duplicate columns
+top_students = df_filtered.iloc[top_order[:5]][['ر.ت', 'اسم التلميذ', 'المعدل'] + analysis_subject_cols]
+top_students = top_students.loc[:, ~top_students.columns.duplicated()].copy()  # Remove duplicate columns
 top_students['الترتيب'] = range(1, len(top_students) + 1)
-top_students['نقاط القوة'] = top_students.apply(lambda row: analyze_student(row, analysis_subject_cols)[0], axis=1)
+top_students['نقاط القوة'] = strength_texts(analysis_grades[top_order[:5]], analysis_subject_cols)
 
 # Format rank
 rank_labels = {1: '🥇 الأول', 2: '🥈 الثاني', 3: '🥉 الثالث', 4: '4️⃣ الرابع', 5: '5️⃣ الخامس'}
 top_students['الترتيب'] = top_students['الترتيب'].map(rank_labels)
 
-top_display = top_students[['الترتيب', 'اسم التلميذ', 'المعدل', 'نقاط القوة']].copy()
-top_display.loc[:, 'المعدل_formatted'] = top_display['المعدل'].astype(float).round(2).astype(str)
-top_display = top_display[['الترتيب', 'اسم التلميذ', 'المعدل_formatted', 'نقاط القوة']]
-top_display.columns = ['الترتيب', 'اسم التلميذ', 'المعدل', 'نقاط القوة']
+# The averages stay floats and the frontend formats them, instead of building a string column per table
+AVERAGE_COLUMN_CONFIG = {'المعدل': st.column_config.NumberColumn('المعدل', format='%.2f')}
 
-st.dataframe(top_display, use_container_width=True, hide_index=True)
+top_display = top_students[['الترتيب', 'اسم التلميذ', 'المعدل', 'نقاط القوة']]
+
+st.dataframe(top_display, column_config=AVERAGE_COLUMN_CONFIG, use_container_width=True, hide_index=True)
 
 # Highlight top performer
 if len(top_students) > 0:
@@ -1352,45 +1589,48 @@ if len(top_students) > 0:
 # Create bottom performers table
 st.markdown("### 📉 أضعف التلاميذ")
 
-bottom_students = df_filtered.nsmallest(5, 'المعدل')[['ر.ت', 'اسم التلميذ', 'المعدل'] + analysis_subject_cols].copy()
-bottom_students = bottom_students.loc[:, ~bottom_students.columns.duplicated()]  # Remove duplicate columns
+bottom_students = df_filtered.iloc[bottom_order[:5]][['ر.ت', 'اسم التلميذ', 'المعدل'] + analysis_subject_cols]
+bottom_students = bottom_students.loc[:, ~bottom_students.columns.duplicated()].copy()  # Remove duplicate columns
 bottom_students['الترتيب'] = range(1, len(bottom_students) + 1)
 
-def get_weakness_details(row, subject_cols):
-    scores = {col: row[col] for col in subject_cols if pd.notna(row.get(col))}
-    if not scores:
-        return "—"
-    sorted_scores = sorted(scores.items(), key=lambda x: x[1])
-    failing_subjects = [(s, sc) for s, sc in sorted_scores if sc < 10]
-    if failing_subjects:
-        weakest = failing_subjects[0]
-        if len(failing_subjects) > 1:
-            return f"ضعيف في {weakest[0]} ({weakest[1]:.2f}) + {len(failing_subjects)-1} مواد أخرى"
+def weakness_texts(scores, subject_cols):
+    """Weakest failed subject and how many more are failed, or the best subject when none is"""
+    failing_counts = (scores < 10).sum(axis=1)
+    _, last_max, first_min, _ = grade_extremes(scores)
+    texts = []
+    for row, n_failing, best, weakest in zip(scores, failing_counts, last_max, first_min):
+        if np.isnan(row).all():
+            texts.append("—")
+        elif n_failing > 1:
+            texts.append(f"ضعيف في {subject_cols[weakest]} ({row[weakest]:.2f}) + {n_failing-1} مواد أخرى")
+        elif n_failing == 1:
+            texts.append(f"يحتاج دعماً في {subject_cols[weakest]} ({row[weakest]:.2f})")
         else:
-            return f"يحتاج دعماً في {weakest[0]} ({weakest[1]:.2f})"
-    else:
-        best = sorted_scores[-1]
-        return f"أقوى مادة: {best[0]} ({best[1]:.2f})"
+            texts.append(f"أقوى مادة: {subject_cols[best]} ({row[best]:.2f})")
+    return texts
+
+def ranked_grades(scores, subject_cols, descending=False):
+    """Each row's (subject, grade) pairs sorted by grade, ties in column order like sorted(), skipping NaN"""
+    missing = np.isnan(scores)
+    order = np.argsort(np.where(missing, np.inf, -scores if descending else scores), axis=1, kind='stable')
+    return [[(subject_cols[j], row[j]) for j in row_order[:n_graded]]
+            for row, row_order, n_graded in zip(scores, order, (~missing).sum(axis=1))]
 
-bottom_students['التحليل'] = bottom_students.apply(lambda row: get_weakness_details(row, analysis_subject_cols), axis=1)
+bottom_scores = analysis_grades[bottom_order[:5]]
+bottom_students['التحليل'] = weakness_texts(bottom_scores, analysis_subject_cols)
 
 # Find strength even for weak students
-bottom_students['نقطة قوة'] = bottom_students.apply(
-    lambda row: max([(col, row[col]) for col in analysis_subject_cols if pd.notna(row.get(col))], 
-                   key=lambda x: x[1], default=("—", 0))[0] if any(pd.notna(row.get(col)) for col in analysis_subject_cols) else "—",
-    axis=1
-)
+bottom_best = grade_extremes(bottom_scores)[0]
+bottom_students['نقطة قوة'] = [analysis_subject_cols[best] if has_grades else "—"
+                              for best, has_grades in zip(bottom_best, ~np.isnan(bottom_scores).all(axis=1))]
 
-bottom_display = bottom_students[['الترتيب', 'اسم التلميذ', 'المعدل', 'نقطة قوة', 'التحليل']].copy()
-bottom_display.loc[:, 'المعدل_formatted'] = bottom_display['المعدل'].astype(float).round(2).astype(str)
-bottom_display = bottom_display[['الترتيب', 'اسم التلميذ', 'المعدل_formatted', 'نقطة قوة', 'التحليل']]
-bottom_display.columns = ['الترتيب', 'اسم التلميذ', 'المعدل', 'نقطة قوة', 'التحليل']
+bottom_display = bottom_students[['الترتيب', 'اسم التلميذ', 'المعدل', 'نقطة قوة', 'التحليل']]
 
-st.dataframe(bottom_display, use_container_width=True, hide_index=True)
+st.dataframe(bottom_display, column_config=AVERAGE_COLUMN_CONFIG, use_container_width=True, hide_index=True)
 
 # Quick action recommendation
 if len(bottom_students) > 0:
-    worst_performer = df_filtered.loc[df_filtered['المعدل'].idxmin()]
+    worst_performer = df_filtered.iloc[bottom_order[0]]
     worst_subjects = {col: worst_performer[col] for col in analysis_subject_cols if pd.notna(worst_performer.get(col)) and worst_performer[col] < 10}
     if worst_subjects:
         critical_subject = min(worst_subjects.items(), key=lambda x: x[1])
@@ -1399,34 +1639,28 @@ if len(bottom_students) > 0:
 # Borderline students (close to passing/failing)
 st.markdown("### ⚖️ التلاميذ على الحافة (9-11)")
 
-borderline = df_filtered[(df_filtered['المعدل'] >= 9) & (df_filtered['المعدل'] <= 11)].copy()
+# One pass over the averages array already extracted for the rankings (NaN compares False on both sides)
+borderline = df_filtered.iloc[np.flatnonzero((filtered_grades >= 9.0) & (filtered_grades <= 11.0))]
 if len(borderline) > 0:
     borderline = borderline.sort_values('المعدل')[['ر.ت', 'اسم التلميذ', 'المعدل'] + analysis_subject_cols]
-    borderline = borderline.loc[:, ~borderline.columns.duplicated()]  # Remove duplicate columns
+    borderline = borderline.loc[:, ~borderline.columns.duplicated()].copy()  # Remove duplicate columns
     
     borderline['الحالة'] = borderline['المعدل'].apply(
         lambda x: '🔴 قريب من الرسوب' if float(x) < 10 else '🟢 ناجح بفارق بسيط'
     )
     
-    def get_weakest_subject(row):
-        scores = [(col, row[col]) for col in analysis_subject_cols if col in row.index and pd.notna(row.get(col))]
-        if scores:
-            weakest = min(scores, key=lambda x: x[1])
-            return f"{weakest[0]} ({float(weakest[1]):.2f})"
-        return "—"
-    
-    borderline['المادة المؤثرة'] = borderline.apply(get_weakest_subject, axis=1)
+    borderline_scores = borderline[analysis_subject_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+    borderline_weakest = grade_extremes(borderline_scores)[2]
+    borderline['المادة المؤثرة'] = [f"{analysis_subject_cols[weakest]} ({row[weakest]:.2f})" if not np.isnan(row).all() else "—"
+                                    for row, weakest in zip(borderline_scores, borderline_weakest)]
     
-    borderline_display = borderline[['اسم التلميذ', 'المعدل', 'الحالة', 'المادة المؤثرة']].head(10).copy()
-    borderline_display.loc[:, 'المعدل_formatted'] = borderline_display['المعدل'].astype(float).round(2).astype(str)
-    borderline_display = borderline_display[['اسم التلميذ', 'المعدل_formatted', 'الحالة', 'المادة المؤثرة']]
-    borderline_display.columns = ['اسم التلميذ', 'المعدل', 'الحالة', 'المادة المؤثرة']
+    borderline_display = borderline[['اسم التلميذ', 'المعدل', 'الحالة', 'المادة المؤثرة']].head(10)
     
-    st.dataframe(borderline_display, use_container_width=True, hide_index=True)
+    st.dataframe(borderline_display, column_config=AVERAGE_COLUMN_CONFIG, use_container_width=True, hide_index=True)
     
     # Quick insight
-    below_10 = len(borderline[borderline['المعدل'] < 10])
-    above_10 = len(borderline[borderline['المعدل'] >= 10])
+    below_10 = int((borderline['المعدل'] < 10).sum())
+    above_10 = len(borderline) - below_10
     st.info(f"📊 من بين {len(borderline)} تلميذ على الحافة: **{below_10}** قريبون من الرسوب، **{above_10}** ناجحون بفارق بسيط")
 else:
     st.success("✅ لا يوجد تلاميذ على حافة النجاح/الرسوب")
@@ -1436,21 +1670,14 @@ st.markdown("---")
 # Grade Brackets Analysis
 st.header("📊 تحليل شرائح المعدلات")
 
-# Create grade brackets
-def get_bracket(grade):
-    if pd.isna(grade):
-        return None
-    elif grade < 10:
-        return "0 - 9.99 (دون المعدل)"
-    elif grade < 12:
-        return "10 - 11.99 (متوسط)"
-    else:
-        return "12 - 20 (جيد/ممتاز)"
-
-df_filtered['Bracket'] = df_filtered['المعدل'].apply(get_bracket)
+# Create grade brackets: one searchsorted pass gives each grade's bracket code, a missing grade gets none (-1),
+# and the codes become a categorical column directly
+BRACKET_LABELS = ["0 - 9.99 (دون المعدل)", "10 - 11.99 (متوسط)", "12 - 20 (جيد/ممتاز)"]
+bracket_idx = np.where(np.isnan(filtered_grades), -1, np.searchsorted([10.0, 12.0], filtered_grades, side='right'))
+df_filtered['Bracket'] = pd.Categorical.from_codes(bracket_idx, categories=BRACKET_LABELS)
 
 # Calculate bracket statistics
-bracket_stats = df_filtered.groupby('Bracket').agg({
+bracket_stats = df_filtered.groupby('Bracket', observed=True).agg({
     'المعدل': ['count', 'mean', 'min', 'max', 'std']
 }).round(2)
 bracket_stats.columns = ['Count', 'Mean', 'Min', 'Max', 'Std Dev']
@@ -1459,9 +1686,9 @@ bracket_stats = bracket_stats.reset_index()
 # Display metrics for each bracket
 col1, col2, col3 = st.columns(3)
 
-below_avg = df_filtered[df_filtered['المعدل'] < 10]
-average = df_filtered[(df_filtered['المعدل'] >= 10) & (df_filtered['المعدل'] < 12)]
-good = df_filtered[df_filtered['المعدل'] >= 12]
+below_avg = df_filtered[bracket_idx == 0]
+average = df_filtered[bracket_idx == 1]
+good = df_filtered[bracket_idx == 2]
 
 with col1:
     st.markdown("### 🔴 دون المعدل (0 - 9.99)")
@@ -1486,7 +1713,8 @@ with col3:
 
 # Pie chart for bracket distribution
 st.subheader("توزيع المعدلات حسب الشرائح")
-bracket_counts = df_filtered['Bracket'].value_counts().reset_index()
+bracket_counts = df_filtered['Bracket'].value_counts()
+bracket_counts = bracket_counts[bracket_counts > 0].reset_index()  # a categorical also counts its empty brackets
 bracket_counts.columns = ['Bracket', 'Count']
 
 col1, col2 = st.columns(2)
@@ -1598,22 +1826,20 @@ with col1:
 # Grade distribution
 with col2:
     st.subheader("توزيع المعدلات")
-    fig = px.histogram(
-        df_filtered,
-        x='المعدل',
-        nbins=20,
-        color_discrete_sequence=['#636EFA']
+    class_mean = df_filtered['المعدل'].mean()
+    fig = go.Figure(
+        data=[histogram_bars(filtered_grades[graded_rows])],
+        layout=dict(height=400, bargap=0, xaxis_title='المعدل', yaxis_title='عدد التلاميذ')
     )
-    fig.add_vline(df_filtered['المعدل'].mean(), line_dash="dash", line_color="red", 
-                   annotation_text=f"المتوسط: {df_filtered['المعدل'].mean():.2f}")
-    fig.update_layout(height=400)
+    fig.add_vline(class_mean, line_dash="dash", line_color="red", annotation_text=f"المتوسط: {class_mean:.2f}")
     st.plotly_chart(fig, use_container_width=True)
 
 st.markdown("---")
 
 # Student Rankings
 st.header("🏆 أفضل 10 تلاميذ حسب المعدل")
-top_students = df_filtered[['اسم التلميذ', 'المعدل']].dropna().nlargest(10, 'المعدل')
+# Same ranking as the top-5 table above
+top_students = df_filtered.iloc[top_order[:10]][['اسم التلميذ', 'المعدل']]
 st.dataframe(top_students.reset_index(drop=True), use_container_width=True)
 
 st.markdown("---")
@@ -1631,17 +1857,20 @@ st.markdown("""
 - **صندوق في موضع أعلى** يعني أداء عام أفضل في تلك المادة
 """)
 
-subject_data = []
-for col in subject_columns:
-    if col in df_filtered.columns:
-        valid_data = df_filtered[col].dropna()
-        for grade in valid_data:
-            subject_data.append({'المادة': col, 'التقدير': grade})
-
-if subject_data:
-    subject_box_df = pd.DataFrame(subject_data)
-    fig = px.box(subject_box_df, x='المادة', y='التقدير', color='المادة')
-    fig.update_layout(height=500, showlegend=False)
+subject_box_df = calculate_subject_box_data(df_filtered, subject_columns)
+
+if len(subject_box_df) > 0:
+    # Only the precomputed box statistics and the outliers are sent to the browser, not every grade
+    fig = go.Figure()
+    box_colors = px.colors.qualitative.Plotly
+    for i, (subject, q1, median, q3, lowerfence, upperfence, outliers) in enumerate(subject_box_df.itertuples(index=False)):
+        color = box_colors[i % len(box_colors)]
+        fig.add_trace(go.Box(x=[subject], q1=[q1], median=[median], q3=[q3],
+                             lowerfence=[lowerfence], upperfence=[upperfence], name=subject, marker_color=color))
+        if len(outliers) > 0:
+            fig.add_trace(go.Scatter(x=[subject] * len(outliers), y=outliers, mode='markers', name=subject,
+                                     marker_color=color))
+    fig.update_layout(height=500, showlegend=False, xaxis_title='المادة', yaxis_title='التقدير')
     st.plotly_chart(fig, use_container_width=True)
     
     # Add subject-specific insights
@@ -1680,21 +1909,11 @@ science_subjects = ['الرياضيات', 'علوم الحياة والأرض',
 humanities_subjects = ['اللغة العربية', 'اللغة الفرنسية', 'اللغة الإنجليزية', 'الاجتماعيات', 'التربية الإسلامية']
 
 # Calculate averages for each group
-science_scores = []
-humanities_scores = []
-
-for col in science_subjects:
-    if col in df_filtered.columns:
-        valid_data = df_filtered[col].dropna()
-        science_scores.extend(valid_data.tolist())
-
-for col in humanities_subjects:
-    if col in df_filtered.columns:
-        valid_data = df_filtered[col].dropna()
-        humanities_scores.extend(valid_data.tolist())
+science_scores = stacked_grades(df_filtered, science_subjects)
+humanities_scores = stacked_grades(df_filtered, humanities_subjects)
 
-science_avg = np.mean(science_scores) if science_scores else 0
-humanities_avg = np.mean(humanities_scores) if humanities_scores else 0
+science_avg = science_scores.mean() if science_scores.size else 0
+humanities_avg = humanities_scores.mean() if humanities_scores.size else 0
 
 # Per-student comparison using cached function
 student_science_avg, student_humanities_avg = calculate_student_orientation(df_filtered, science_subjects, humanities_subjects)
@@ -1727,42 +1946,26 @@ col1, col2 = st.columns(2)
 
 with col1:
     # Bar chart comparison
-    comparison_df = pd.DataFrame({
-        'المجال': ['المواد العلمية 🔬', 'المواد الأدبية 📚'],
-        'المتوسط': [science_avg, humanities_avg]
-    })
-    
-    fig = px.bar(
-        comparison_df,
-        x='المجال',
-        y='المتوسط',
-        color='المجال',
-        color_discrete_map={
-            'المواد العلمية 🔬': '#636EFA',
-            'المواد الأدبية 📚': '#EF553B'
-        },
-        text='المتوسط'
+    field_avgs = [science_avg, humanities_avg]
+    fig = go.Figure(
+        data=[go.Bar(x=['المواد العلمية 🔬', 'المواد الأدبية 📚'], y=field_avgs, marker_color=['#636EFA', '#EF553B'],
+                     text=field_avgs, texttemplate='%{text:.2f}', textposition='outside')],
+        layout=dict(height=400, showlegend=False, xaxis_title='المجال', yaxis_title='المتوسط',
+                    **reference_line('h', 10, 'green', 'معدل النجاح (10)'))
     )
-    fig.update_traces(texttemplate='%{text:.2f}', textposition='outside')
-    fig.update_layout(height=400, showlegend=False)
-    fig.add_hline(y=10, line_dash="dash", line_color="green", annotation_text="معدل النجاح (10)")
     st.plotly_chart(fig, use_container_width=True)
 
 with col2:
     # Detailed subject comparison
-    subject_comparison = []
-    for col in science_subjects:
-        if col in df_filtered.columns:
-            avg = df_filtered[col].dropna().mean()
-            subject_comparison.append({'المادة': col, 'المتوسط': avg, 'المجال': 'علمي'})
-    
-    for col in humanities_subjects:
-        if col in df_filtered.columns:
-            avg = df_filtered[col].dropna().mean()
-            subject_comparison.append({'المادة': col, 'المتوسط': avg, 'المجال': 'أدبي'})
-    
-    if subject_comparison:
-        subject_comp_df = pd.DataFrame(subject_comparison)
+    # One mean reduction over all the science and humanities columns present, instead of one dropna().mean() each
+    comparison_cols = [col for col in science_subjects + humanities_subjects if col in df_filtered.columns]
+    
+    if comparison_cols:
+        subject_comp_df = pd.DataFrame({
+            'المادة': comparison_cols,
+            'المتوسط': df_filtered[comparison_cols].mean().to_numpy(),
+            'المجال': ['علمي' if col in science_subjects else 'أدبي' for col in comparison_cols]
+        })
         fig = px.bar(
             subject_comp_df.sort_values('المتوسط', ascending=True),
             x='المتوسط',
@@ -1790,10 +1993,12 @@ else:
 
 # Student distribution by tilt
 if len(student_science_avg) == len(df_filtered) and len(student_humanities_avg) == len(df_filtered):
-    df_filtered_copy = df_filtered.copy()
-    df_filtered_copy['معدل_العلوم'] = student_science_avg
-    df_filtered_copy['معدل_الآداب'] = student_humanities_avg
-    df_filtered_copy['الفرق'] = df_filtered_copy['معدل_العلوم'] - df_filtered_copy['معدل_الآداب']
+    # assign returns a new frame, so the enrichment column added below never reaches df_filtered
+    df_filtered_copy = df_filtered.assign(**{
+        'معدل_العلوم': student_science_avg,
+        'معدل_الآداب': student_humanities_avg,
+        'الفرق': student_science_avg - student_humanities_avg,
+    })
     
     science_tilt = len(df_filtered_copy[df_filtered_copy['الفرق'] > 0.5])
     humanities_tilt = len(df_filtered_copy[df_filtered_copy['الفرق'] < -0.5])
@@ -1818,15 +2023,11 @@ st.markdown("""
 
 # Define enrichment subjects
 enrichment_subjects = ['التربية البدنية', 'المعلوميات']
+present_enrichment = [subj for subj in enrichment_subjects if subj in df_filtered.columns]
 
 # Calculate enrichment average
-enrichment_scores = []
-for col in enrichment_subjects:
-    if col in df_filtered.columns:
-        valid_data = df_filtered[col].dropna()
-        enrichment_scores.extend(valid_data.tolist())
-
-enrichment_avg = np.mean(enrichment_scores) if enrichment_scores else 0
+enrichment_scores = stacked_grades(df_filtered, enrichment_subjects)
+enrichment_avg = enrichment_scores.mean() if enrichment_scores.size else 0
 
 # Display enrichment subjects overview
 col1, col2, col3, col4 = st.columns(4)
@@ -1836,18 +2037,17 @@ with col1:
     st.metric("المتوسط العام", f"{enrichment_avg:.2f}")
     st.caption("التربية البدنية، المعلوميات")
 
-# Individual enrichment subjects
-enrichment_avgs = {}
+# Individual enrichment subjects, averaged in one reduction over the present columns
+enrichment_avgs = df_filtered[present_enrichment].mean().to_dict()
 for i, col_name in enumerate(enrichment_subjects):
-    if col_name in df_filtered.columns:
-        avg = df_filtered[col_name].dropna().mean()
-        enrichment_avgs[col_name] = avg
+    if col_name in enrichment_avgs:
+        avg = enrichment_avgs[col_name]
         with [col2, col3, col4][i]:
             emoji = ['🕌', '🏃', '💻'][i]
             st.metric(f"{emoji} {col_name}", f"{avg:.2f}")
 
 # Analyze enrichment performance by student orientation
-if student_science_avg and student_humanities_avg and len(student_science_avg) == len(student_humanities_avg):
+if len(student_science_avg) > 0 and len(student_humanities_avg) > 0 and len(student_science_avg) == len(student_humanities_avg):
     st.markdown("### 📊 أداء مواد التفتح حسب توجه التلميذ")
     
     # Calculate enrichment average for each student using cached function
@@ -1855,15 +2055,17 @@ if student_science_avg and student_humanities_avg and len(student_science_avg) =
     
     df_filtered_copy['معدل_التفتح'] = student_enrichment_avg[:len(df_filtered)]
     
-    # Categorize students
-    science_students = df_filtered_copy[df_filtered_copy['الفرق'] > 0.5]
-    humanities_students = df_filtered_copy[df_filtered_copy['الفرق'] < -0.5]
-    balanced_students = df_filtered_copy[(df_filtered_copy['الفرق'] >= -0.5) & (df_filtered_copy['الفرق'] <= 0.5)]
+    # Categorize students: one orientation label per student (none when the difference is missing)
+    orientation_diff = df_filtered_copy['الفرق'].to_numpy()
+    orientation_label = np.select([orientation_diff > 0.5, orientation_diff < -0.5, np.abs(orientation_diff) <= 0.5],
+                                  ['علميون', 'أدبيون', 'متوازنون'], default=None)
     
-    # Calculate enrichment averages by orientation
-    science_enrichment = science_students['معدل_التفتح'].dropna().mean() if len(science_students) > 0 else 0
-    humanities_enrichment = humanities_students['معدل_التفتح'].dropna().mean() if len(humanities_students) > 0 else 0
-    balanced_enrichment = balanced_students['معدل_التفتح'].dropna().mean() if len(balanced_students) > 0 else 0
+    # Calculate enrichment averages by orientation with a single groupby; an orientation without students gets 0
+    orientation_groups = df_filtered_copy.groupby(orientation_label)
+    orientation_order = ['علميون', 'أدبيون', 'متوازنون']
+    orientation_sizes = orientation_groups.size().reindex(orientation_order, fill_value=0)
+    orientation_means = orientation_groups[present_enrichment + ['معدل_التفتح']].mean().reindex(orientation_order, fill_value=0)
+    science_enrichment, humanities_enrichment, balanced_enrichment = orientation_means['معدل_التفتح']
     
     # Display comparison
     col1, col2, col3 = st.columns(3)
@@ -1872,21 +2074,21 @@ if student_science_avg and student_humanities_avg and len(student_science_avg) =
         st.metric(
             "🔬 العلميون في التفتح", 
             f"{science_enrichment:.2f}" if science_enrichment > 0 else "—",
-            help=f"معدل مواد التفتح للتلاميذ ذوي التوجه العلمي ({len(science_students)} تلميذ)"
+            help=f"معدل مواد التفتح للتلاميذ ذوي التوجه العلمي ({orientation_sizes['علميون']} تلميذ)"
         )
     
     with col2:
         st.metric(
             "⚖️ المتوازنون في التفتح", 
             f"{balanced_enrichment:.2f}" if balanced_enrichment > 0 else "—",
-            help=f"معدل مواد التفتح للتلاميذ المتوازنين ({len(balanced_students)} تلميذ)"
+            help=f"معدل مواد التفتح للتلاميذ المتوازنين ({orientation_sizes['متوازنون']} تلميذ)"
         )
     
     with col3:
         st.metric(
             "📚 الأدبيون في التفتح", 
             f"{humanities_enrichment:.2f}" if humanities_enrichment > 0 else "—",
-            help=f"معدل مواد التفتح للتلاميذ ذوي التوجه الأدبي ({len(humanities_students)} تلميذ)"
+            help=f"معدل مواد التفتح للتلاميذ ذوي التوجه الأدبي ({orientation_sizes['أدبيون']} تلميذ)"
         )
     
     # Visualization
@@ -1894,44 +2096,20 @@ if student_science_avg and student_humanities_avg and len(student_science_avg) =
     
     with col1:
         # Bar chart for enrichment by orientation
-        orientation_enrichment_df = pd.DataFrame({
-            'التوجه': ['🔬 علميون', '⚖️ متوازنون', '📚 أدبيون'],
-            'معدل التفتح': [science_enrichment, balanced_enrichment, humanities_enrichment],
-            'عدد التلاميذ': [len(science_students), len(balanced_students), len(humanities_students)]
-        })
-        
-        fig = px.bar(
-            orientation_enrichment_df,
-            x='التوجه',
-            y='معدل التفتح',
-            color='التوجه',
-            color_discrete_map={
-                '🔬 علميون': '#636EFA',
-                '⚖️ متوازنون': '#00CC96',
-                '📚 أدبيون': '#EF553B'
-            },
-            text='معدل التفتح'
+        orientation_enrichment = [science_enrichment, balanced_enrichment, humanities_enrichment]
+        fig = go.Figure(
+            data=[go.Bar(x=['🔬 علميون', '⚖️ متوازنون', '📚 أدبيون'], y=orientation_enrichment, marker_color=['#636EFA', '#00CC96', '#EF553B'],
+                         text=orientation_enrichment, texttemplate='%{text:.2f}', textposition='outside')],
+            layout=dict(height=400, showlegend=False, title="معدل مواد التفتح حسب التوجه", xaxis_title='التوجه', yaxis_title='معدل التفتح',
+                        **reference_line('h', 10, 'green', 'معدل النجاح'))
         )
-        fig.update_traces(texttemplate='%{text:.2f}', textposition='outside')
-        fig.update_layout(height=400, showlegend=False, title="معدل مواد التفتح حسب التوجه")
-        fig.add_hline(y=10, line_dash="dash", line_color="green", annotation_text="معدل النجاح")
         st.plotly_chart(fig, use_container_width=True)
     
     with col2:
         # Detailed enrichment subjects by orientation
-        detailed_data = []
-        for subj in enrichment_subjects:
-            if subj in df_filtered.columns:
-                sci_avg = science_students[subj].dropna().mean() if len(science_students) > 0 else 0
-                hum_avg = humanities_students[subj].dropna().mean() if len(humanities_students) > 0 else 0
-                bal_avg = balanced_students[subj].dropna().mean() if len(balanced_students) > 0 else 0
-                
-                detailed_data.append({'المادة': subj, 'المعدل': sci_avg, 'التوجه': 'علميون'})
-                detailed_data.append({'المادة': subj, 'المعدل': hum_avg, 'التوجه': 'أدبيون'})
-                detailed_data.append({'المادة': subj, 'المعدل': bal_avg, 'التوجه': 'متوازنون'})
-        
-        if detailed_data:
-            detailed_df = pd.DataFrame(detailed_data)
+        if present_enrichment:
+            detailed_df = (orientation_means[present_enrichment].rename_axis('التوجه').reset_index()
+                           .melt(id_vars='التوجه', var_name='المادة', value_name='المعدل'))
             fig = px.bar(
                 detailed_df,
                 x='المادة',
@@ -1950,18 +2128,15 @@ if student_science_avg and student_humanities_avg and len(student_science_avg) =
     # Insights
     st.markdown("### 💡 استنتاجات مواد التفتح")
     
-    # Determine who performs better
-    best_in_enrichment = max(
-        [('العلميون', science_enrichment), ('المتوازنون', balanced_enrichment), ('الأدبيون', humanities_enrichment)],
-        key=lambda x: x[1] if x[1] > 0 else -999
-    )
-    
-    worst_in_enrichment = min(
-        [('العلميون', science_enrichment), ('المتوازنون', balanced_enrichment), ('الأدبيون', humanities_enrichment)],
-        key=lambda x: x[1] if x[1] > 0 else 999
-    )
+    # Determine who performs better, among the orientations with a positive enrichment average
+    enrichment_groups = ['العلميون', 'المتوازنون', 'الأدبيون']
+    enrichment_scored = np.array([science_enrichment, balanced_enrichment, humanities_enrichment], dtype=np.float64)
+    enrichment_scored[~(enrichment_scored > 0)] = np.nan
     
-    if best_in_enrichment[1] > 0 and worst_in_enrichment[1] > 0:
+    if not np.isnan(enrichment_scored).all():
+        best_idx, worst_idx = np.nanargmax(enrichment_scored), np.nanargmin(enrichment_scored)
+        best_in_enrichment = (enrichment_groups[best_idx], enrichment_scored[best_idx])
+        worst_in_enrichment = (enrichment_groups[worst_idx], enrichment_scored[worst_idx])
         diff_enrichment = best_in_enrichment[1] - worst_in_enrichment[1]
         
         if diff_enrichment < 0.3:
@@ -1970,18 +2145,17 @@ if student_science_avg and student_humanities_avg and len(student_science_avg) =
             st.info(f"📊 **{best_in_enrichment[0]}** هم الأفضل في مواد التفتح بمعدل **{best_in_enrichment[1]:.2f}**، متفوقين على {worst_in_enrichment[0]} بفارق **{diff_enrichment:.2f}** نقطة.")
         
         # Individual subject insights
-        for subj in enrichment_subjects:
-            if subj in df_filtered.columns:
-                sci_avg = science_students[subj].dropna().mean() if len(science_students) > 0 else 0
-                hum_avg = humanities_students[subj].dropna().mean() if len(humanities_students) > 0 else 0
-                
-                if sci_avg > 0 and hum_avg > 0:
-                    subj_diff = sci_avg - hum_avg
-                    if abs(subj_diff) >= 0.5:
-                        if subj_diff > 0:
-                            st.caption(f"🔬 **{subj}:** العلميون أفضل بفارق {subj_diff:.2f}")
-                        else:
-                            st.caption(f"📚 **{subj}:** الأدبيون أفضل بفارق {abs(subj_diff):.2f}")
+        for subj in present_enrichment:
+            sci_avg = orientation_means.at['علميون', subj]
+            hum_avg = orientation_means.at['أدبيون', subj]
+            
+            if sci_avg > 0 and hum_avg > 0:
+                subj_diff = sci_avg - hum_avg
+                if abs(subj_diff) >= 0.5:
+                    if subj_diff > 0:
+                        st.caption(f"🔬 **{subj}:** العلميون أفضل بفارق {subj_diff:.2f}")
+                    else:
+                        st.caption(f"📚 **{subj}:** الأدبيون أفضل بفارق {abs(subj_diff):.2f}")
 
 st.markdown("---")
 
@@ -1996,10 +2170,18 @@ st.markdown("""
 primary_language = 'اللغة العربية'
 foreign_languages = ['اللغة الفرنسية', 'اللغة الإنجليزية']
 
-# Calculate averages
-arabic_avg = df_filtered[primary_language].dropna().mean() if primary_language in df_filtered.columns else 0
-french_avg = df_filtered['اللغة الفرنسية'].dropna().mean() if 'اللغة الفرنسية' in df_filtered.columns else 0
-english_avg = df_filtered['اللغة الإنجليزية'].dropna().mean() if 'اللغة الإنجليزية' in df_filtered.columns else 0
+# The three language columns as one (students, languages) matrix, a missing column reading as all NaN;
+# the averages and pass rates below are column reductions over it
+languages = [primary_language, *foreign_languages]
+language_present = np.array([lang in df_filtered.columns for lang in languages])
+language_grades = df_filtered.reindex(columns=languages).to_numpy(dtype=np.float64, na_value=np.nan)
+language_graded = (~np.isnan(language_grades)).sum(axis=0)
+
+# Calculate averages and pass rates (a missing column counts as 0, a column without grades as NaN)
+with np.errstate(invalid='ignore', divide='ignore'):
+    language_avgs = np.where(language_present, np.nansum(language_grades, axis=0) / language_graded, 0)
+    language_pass = np.where(language_present, (language_grades >= 10).sum(axis=0) / language_graded * 100, 0)
+arabic_avg, french_avg, english_avg = language_avgs.tolist()
 foreign_avg = np.mean([french_avg, english_avg]) if french_avg > 0 or english_avg > 0 else 0
 
 # Language proficiency gap
@@ -2044,96 +2226,23 @@ col1, col2 = st.columns(2)
 
 with col1:
     # Bar chart for language comparison
-    lang_df = pd.DataFrame({
-        'اللغة': ['🇲🇦 العربية', '🇫🇷 الفرنسية', '🇬🇧 الإنجليزية'],
-        'المتوسط': [arabic_avg, french_avg, english_avg],
-        'النوع': ['اللغة الأم', 'لغة أجنبية', 'لغة أجنبية']
-    })
-    
-    fig = px.bar(
-        lang_df,
-        x='اللغة',
-        y='المتوسط',
-        color='النوع',
-        color_discrete_map={
-            'اللغة الأم': '#00CC96',
-            'لغة أجنبية': '#EF553B'
-        },
-        text='المتوسط'
-    )
-    fig.update_traces(texttemplate='%{text:.2f}', textposition='outside')
-    fig.update_layout(height=400, showlegend=True, title="مقارنة الأداء اللغوي")
-    fig.add_hline(y=10, line_dash="dash", line_color="gray", annotation_text="معدل النجاح")
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(language_bar_figure(arabic_avg, french_avg, english_avg), use_container_width=True)
 
 with col2:
     # Radar chart for language skills
-    categories = ['العربية', 'الفرنسية', 'الإنجليزية']
-    
-    fig = go.Figure()
-    
-    fig.add_trace(go.Scatterpolar(
-        r=[arabic_avg, french_avg, english_avg],
-        theta=categories,
-        fill='toself',
-        name='المتوسط الفعلي',
-        line_color='#636EFA'
-    ))
-    
-    # Add reference line for passing grade
-    fig.add_trace(go.Scatterpolar(
-        r=[10, 10, 10],
-        theta=categories,
-        fill='toself',
-        name='معدل النجاح',
-        line_color='#00CC96',
-        opacity=0.3
-    ))
-    
-    fig.update_layout(
-        polar=dict(
-            radialaxis=dict(
-                visible=True,
-                range=[0, 20]
-            )
-        ),
-        showlegend=True,
-        title="مخطط الكفاءة اللغوية",
-        height=400
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(language_radar_figure(arabic_avg, french_avg, english_avg), use_container_width=True)
 
 # Per-student language gap analysis
 st.markdown("### 📈 توزيع الفجوة اللغوية لدى التلاميذ")
 
-student_arabic = []
-student_foreign = []
-student_gap = []
-
-for idx, row in df_filtered.iterrows():
-    ar = row.get(primary_language) if primary_language in df_filtered.columns else np.nan
-    fr = row.get('اللغة الفرنسية') if 'اللغة الفرنسية' in df_filtered.columns else np.nan
-    en = row.get('اللغة الإنجليزية') if 'اللغة الإنجليزية' in df_filtered.columns else np.nan
-    
-    if pd.notna(ar):
-        student_arabic.append(ar)
-        foreign_vals = [v for v in [fr, en] if pd.notna(v)]
-        if foreign_vals:
-            foreign_mean = np.mean(foreign_vals)
-            student_foreign.append(foreign_mean)
-            student_gap.append(ar - foreign_mean)
-        else:
-            student_foreign.append(np.nan)
-            student_gap.append(np.nan)
-    else:
-        student_arabic.append(np.nan)
-        student_foreign.append(np.nan)
-        student_gap.append(np.nan)
+# Each student's Arabic grade minus the mean of their available foreign-language grades; NaN when either side is missing
+student_arabic = language_grades[:, 0]
+student_gap = student_arabic - row_means(df_filtered, foreign_languages)
 
-# Categorize students by gap
-positive_gap = sum(1 for g in student_gap if pd.notna(g) and g > 1)  # Better in Arabic
-small_gap = sum(1 for g in student_gap if pd.notna(g) and -1 <= g <= 1)  # Balanced
-negative_gap = sum(1 for g in student_gap if pd.notna(g) and g < -1)  # Better in foreign languages
+# Categorize students by gap in one counting pass over the known gaps: 0 = better in foreign languages (< -1),
+# 1 = balanced (-1 to 1), 2 = better in Arabic (> 1)
+known_gaps = student_gap[~np.isnan(student_gap)]
+negative_gap, small_gap, positive_gap = np.bincount((known_gaps >= -1).astype(np.intp) + (known_gaps > 1), minlength=3).tolist()
 
 col1, col2, col3 = st.columns(3)
 
@@ -2159,24 +2268,8 @@ with col3:
     )
 
 # Histogram of language gap
-if student_gap:
-    valid_gaps = [g for g in student_gap if pd.notna(g)]
-    if valid_gaps:
-        gap_df = pd.DataFrame({'الفجوة اللغوية': valid_gaps})
-        fig = px.histogram(
-            gap_df,
-            x='الفجوة اللغوية',
-            nbins=20,
-            color_discrete_sequence=['#636EFA']
-        )
-        fig.add_vline(x=0, line_dash="dash", line_color="red", annotation_text="توازن")
-        fig.update_layout(
-            title="توزيع الفجوة اللغوية (العربية - اللغات الأجنبية)",
-            xaxis_title="الفجوة (قيم موجبة = أفضل في العربية)",
-            yaxis_title="عدد التلاميذ",
-            height=350
-        )
-        st.plotly_chart(fig, use_container_width=True)
+if known_gaps.size:
+    st.plotly_chart(language_gap_histogram(known_gaps), use_container_width=True)
 
 # French vs English comparison
 st.markdown("### 🇫🇷 vs 🇬🇧 مقارنة اللغتين الأجنبيتين")
@@ -2194,37 +2287,8 @@ with col1:
 
 with col2:
     # Success rates for each language
-    if primary_language in df_filtered.columns:
-        ar_pass = (df_filtered[primary_language].dropna() >= 10).mean() * 100
-    else:
-        ar_pass = 0
-    
-    if 'اللغة الفرنسية' in df_filtered.columns:
-        fr_pass = (df_filtered['اللغة الفرنسية'].dropna() >= 10).mean() * 100
-    else:
-        fr_pass = 0
-    
-    if 'اللغة الإنجليزية' in df_filtered.columns:
-        en_pass = (df_filtered['اللغة الإنجليزية'].dropna() >= 10).mean() * 100
-    else:
-        en_pass = 0
-    
-    pass_df = pd.DataFrame({
-        'اللغة': ['العربية', 'الفرنسية', 'الإنجليزية'],
-        'نسبة النجاح %': [ar_pass, fr_pass, en_pass]
-    })
-    
-    fig = px.bar(
-        pass_df,
-        x='اللغة',
-        y='نسبة النجاح %',
-        color='نسبة النجاح %',
-        color_continuous_scale='RdYlGn',
-        text='نسبة النجاح %'
-    )
-    fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-    fig.update_layout(height=300, title="نسبة النجاح في كل لغة")
-    st.plotly_chart(fig, use_container_width=True)
+    lang_pass = tuple(language_pass.tolist())
+    st.plotly_chart(language_pass_figure(lang_pass), use_container_width=True)
 
 # Insights
 st.markdown("### 💡 استنتاجات الكفاءة اللغوية")
@@ -2260,12 +2324,11 @@ st.markdown("""
 """)
 
 # Get available subjects for correlation
-correlation_subjects = [col for col in subject_columns if col in df_filtered.columns and col != 'المعدل']
-correlation_data = df_filtered[correlation_subjects].dropna()
+correlation_subjects = analysis_subject_cols
+# Cached, so the selectboxes below rerun without recomputing the matrix
+corr_matrix, corr_df = calculate_subject_correlations(analysis_grades, correlation_subjects)
 
-if len(correlation_data) > 5 and len(correlation_subjects) > 1:
-    # Calculate correlation matrix
-    corr_matrix = correlation_data.corr()
+if corr_matrix is not None:
     
     # Heatmap visualization
     st.markdown("### 🗺️ خريطة الارتباط الحرارية")
@@ -2303,28 +2366,13 @@ if len(correlation_data) > 5 and len(correlation_subjects) > 1:
     # Find strongest correlations (excluding self-correlation)
     st.markdown("### 📊 أقوى العلاقات بين المواد")
     
-    # Get upper triangle of correlation matrix (to avoid duplicates)
-    correlations = []
-    for i in range(len(correlation_subjects)):
-        for j in range(i + 1, len(correlation_subjects)):
-            correlations.append({
-                'المادة 1': correlation_subjects[i],
-                'المادة 2': correlation_subjects[j],
-                'معامل الارتباط': corr_matrix.iloc[i, j]
-            })
-    
-    corr_df = pd.DataFrame(correlations)
-    corr_df['قوة الارتباط'] = corr_df['معامل الارتباط'].abs()
-    corr_df = corr_df.sort_values('قوة الارتباط', ascending=False)
-    
     # Top 5 strongest correlations
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("#### 🔝 أقوى 5 ارتباطات")
         top_5 = corr_df.head(5)
-        for idx, row in top_5.iterrows():
-            corr_val = row['معامل الارتباط']
+        for subj_1, subj_2, corr_val in zip(top_5['المادة 1'], top_5['المادة 2'], top_5['معامل الارتباط']):
             if corr_val >= 0.7:
                 emoji = "🟢"
                 strength = "قوي جداً"
@@ -2338,13 +2386,12 @@ if len(correlation_data) > 5 and len(correlation_subjects) > 1:
                 emoji = "🔴"
                 strength = "عكسي"
             
-            st.markdown(f"{emoji} **{row['المادة 1']}** ↔ **{row['المادة 2']}**: {corr_val:.2f} ({strength})")
+            st.markdown(f"{emoji} **{subj_1}** ↔ **{subj_2}**: {corr_val:.2f} ({strength})")
     
     with col2:
         st.markdown("#### 📉 أضعف 5 ارتباطات")
         bottom_5 = corr_df.tail(5).iloc[::-1]
-        for idx, row in bottom_5.iterrows():
-            corr_val = row['معامل الارتباط']
+        for subj_1, subj_2, corr_val in zip(bottom_5['المادة 1'], bottom_5['المادة 2'], bottom_5['معامل الارتباط']):
             if abs(corr_val) < 0.2:
                 emoji = "⚪"
                 strength = "شبه معدوم"
@@ -2355,7 +2402,7 @@ if len(correlation_data) > 5 and len(correlation_subjects) > 1:
                 emoji = "🟠"
                 strength = "ضعيف"
             
-            st.markdown(f"{emoji} **{row['المادة 1']}** ↔ **{row['المادة 2']}**: {corr_val:.2f} ({strength})")
+            st.markdown(f"{emoji} **{subj_1}** ↔ **{subj_2}**: {corr_val:.2f} ({strength})")
     
     # Subject-specific correlation analysis
     st.markdown("### 🎯 تحليل ارتباط كل مادة")
@@ -2367,15 +2414,21 @@ if len(correlation_data) > 5 and len(correlation_subjects) > 1:
     )
     
     if selected_subject:
-        subject_corr = corr_matrix[selected_subject].drop(selected_subject).sort_values(ascending=False)
+        # The subject's row of the matrix without its self-correlation, strongest first (NaN last)
+        selected_idx = correlation_subjects.index(selected_subject)
+        others = np.arange(len(correlation_subjects)) != selected_idx
+        subject_corr = corr_matrix.to_numpy()[selected_idx, others]
+        subject_corr_names = np.asarray(correlation_subjects, dtype=object)[others]
+        order = np.argsort(-subject_corr, kind='stable')
+        subject_corr, subject_corr_names = subject_corr[order], subject_corr_names[order]
         
         col1, col2 = st.columns(2)
         
         with col1:
             # Bar chart of correlations
             corr_chart_df = pd.DataFrame({
-                'المادة': subject_corr.index,
-                'معامل الارتباط': subject_corr.values
+                'المادة': subject_corr_names,
+                'معامل الارتباط': subject_corr
             })
             
             fig = px.bar(
@@ -2397,20 +2450,19 @@ if len(correlation_data) > 5 and len(correlation_subjects) > 1:
             # Interpretation
             st.markdown(f"#### 💡 تفسير ارتباطات {selected_subject}")
             
-            strong_positive = subject_corr[subject_corr >= 0.6]
-            moderate_positive = subject_corr[(subject_corr >= 0.4) & (subject_corr < 0.6)]
-            weak = subject_corr[(subject_corr > -0.4) & (subject_corr < 0.4)]
-            negative = subject_corr[subject_corr <= -0.4]
+            strong_positive = subject_corr_names[subject_corr >= 0.6]
+            moderate_positive = subject_corr_names[(subject_corr >= 0.4) & (subject_corr < 0.6)]
+            negative = subject_corr_names[subject_corr <= -0.4]
             
             if len(strong_positive) > 0:
-                st.success(f"🟢 **ارتباط قوي مع:** {', '.join(strong_positive.index.tolist())}")
+                st.success(f"🟢 **ارتباط قوي مع:** {', '.join(strong_positive)}")
                 st.caption("التلاميذ الجيدون في هذه المادة غالباً جيدون في المواد المذكورة")
             
             if len(moderate_positive) > 0:
-                st.info(f"🟡 **ارتباط متوسط مع:** {', '.join(moderate_positive.index.tolist())}")
+                st.info(f"🟡 **ارتباط متوسط مع:** {', '.join(moderate_positive)}")
             
             if len(negative) > 0:
-                st.warning(f"🔴 **ارتباط عكسي مع:** {', '.join(negative.index.tolist())}")
+                st.warning(f"🔴 **ارتباط عكسي مع:** {', '.join(negative)}")
                 st.caption("التلاميذ الجيدون في هذه المادة قد يواجهون صعوبة في المواد المذكورة")
     
     # Scatter plot for specific pairs
@@ -2427,16 +2479,25 @@ if len(correlation_data) > 5 and len(correlation_subjects) > 1:
         scatter_data = df_filtered[[subject_x, subject_y, 'اسم التلميذ']].dropna()
         
         if len(scatter_data) > 0:
-            correlation_value = scatter_data[subject_x].corr(scatter_data[subject_y])
+            # The two grade columns are pulled out once for the coefficient, the trend line and the quadrants
+            x_grades = scatter_data[subject_x].to_numpy(dtype=np.float64)
+            y_grades = scatter_data[subject_y].to_numpy(dtype=np.float64)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                correlation_value = np.corrcoef(x_grades, y_grades)[0, 1] if len(x_grades) > 1 else np.nan
             
-            fig = px.scatter(
-                scatter_data,
-                x=subject_x,
-                y=subject_y,
-                hover_data=['اسم التلميذ'],
-                trendline='ols',
-                color_discrete_sequence=['#636EFA']
+            # WebGL markers with float32 coordinates; the names ride along as customdata for the hover only
+            fig = go.Figure(
+                data=[go.Scattergl(x=x_grades.astype(np.float32), y=y_grades.astype(np.float32), mode='markers',
+                                   marker_color='#636EFA', customdata=scatter_data['اسم التلميذ'].to_numpy(),
+                                   hovertemplate='%{customdata}<br>%{x:.2f} ، %{y:.2f}<extra></extra>', showlegend=False)],
+                layout=dict(xaxis_title=subject_x, yaxis_title=subject_y)
             )
+            # Least-squares trend line fitted here: two endpoints instead of statsmodels' fitted value per student
+            if np.ptp(x_grades) > 0:
+                slope, intercept = np.polyfit(x_grades, y_grades, 1)
+                trend_x = np.array([x_grades.min(), x_grades.max()])
+                fig.add_trace(go.Scatter(x=trend_x, y=intercept + slope * trend_x, mode='lines', name='OLS',
+                                         line_color='#636EFA', showlegend=False))
             fig.update_layout(
                 height=450,
                 title=f"العلاقة بين {subject_x} و {subject_y} (r = {correlation_value:.2f})"
@@ -2447,11 +2508,8 @@ if len(correlation_data) > 5 and len(correlation_subjects) > 1:
             
             st.plotly_chart(fig, use_container_width=True)
             
-            # Quadrant analysis
-            both_pass = len(scatter_data[(scatter_data[subject_x] >= 10) & (scatter_data[subject_y] >= 10)])
-            x_only = len(scatter_data[(scatter_data[subject_x] >= 10) & (scatter_data[subject_y] < 10)])
-            y_only = len(scatter_data[(scatter_data[subject_x] < 10) & (scatter_data[subject_y] >= 10)])
-            both_fail = len(scatter_data[(scatter_data[subject_x] < 10) & (scatter_data[subject_y] < 10)])
+            # Quadrant analysis: a 2-bit code per student (x passed, y passed) counted in one bincount
+            both_fail, y_only, x_only, both_pass = np.bincount(2 * (x_grades >= 10) + (y_grades >= 10), minlength=4).tolist()
             total = len(scatter_data)
             
             col1, col2, col3, col4 = st.columns(4)
@@ -2497,20 +2555,9 @@ st.markdown("""
 """)
 
 if 'المعدل' in df_filtered.columns:
-    # Calculate statistics for classification
-    avg_mean = df_filtered['المعدل'].dropna().mean()
-    avg_std = df_filtered['المعدل'].dropna().std()
-    
-    # Classify students
-    df_analysis = df_filtered[['ر.ت', 'رقم التلميذ', 'اسم التلميذ', 'المعدل'] + [col for col in subject_columns if col != 'المعدل' and col in df_filtered.columns]].copy()
-    df_analysis = df_analysis.dropna(subset=['المعدل'])
-    
-    # Categories
-    borderline_low = df_analysis[(df_analysis['المعدل'] >= 9) & (df_analysis['المعدل'] < 10)]
-    borderline_high = df_analysis[(df_analysis['المعدل'] >= 10) & (df_analysis['المعدل'] < 11)]
-    at_risk = df_analysis[df_analysis['المعدل'] < 9]
-    excellent = df_analysis[df_analysis['المعدل'] >= avg_mean + 1.5 * avg_std]
-    outliers_top = df_analysis[df_analysis['المعدل'] >= avg_mean + 2 * avg_std]
+    # Classify students (cached: widget reruns further down reuse the categories)
+    avg_mean, avg_std, df_analysis, borderline_low, borderline_high, at_risk, excellent, outliers_top = classify_students(
+        df_filtered, subject_columns)
     
     # Summary metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -2543,59 +2590,71 @@ if 'المعدل' in df_filtered.columns:
             help=f"تلاميذ معدلهم أعلى من {avg_mean + 1.5 * avg_std:.2f}"
         )
     
-    # Tab layout for different categories
-    tab1, tab2, tab3, tab4 = st.tabs(["🔴 المعرضون لخطر الهضر المدرسي", "🟡 على الحافة", "⭐ المتميزون", "📊 تحليل الضعف"])
+    # Find subjects where most students struggle: one reduction per statistic over the grade matrix,
+    # keeping the subjects that have at least one grade (NaN grades never count as failing).
+    # Computed ahead of the sections because the recommendations need it whichever section is open
+    # The failed-grade matrix (NaN is never < 10) is built once and also feeds the multi-failure table
+    failed_grades = analysis_grades < 10
+    graded_counts = (~np.isnan(analysis_grades)).sum(axis=0)
+    has_grades = graded_counts > 0
+    failing_counts = failed_grades.sum(axis=0)[has_grades]
+    graded_counts = graded_counts[has_grades]
+    # Empty until there are graded subjects, so the recommendations can test it without probing the namespace
+    critical_subjects = pd.DataFrame()
+    
+    if has_grades.any():
+        failure_df = pd.DataFrame({
+            'المادة': [col for col, keep in zip(analysis_subject_cols, has_grades) if keep],
+            'عدد الراسبين': failing_counts,
+            'نسبة الرسوب %': failing_counts / graded_counts * 100,
+            'المتوسط': np.nansum(analysis_grades[:, has_grades], axis=0) / graded_counts
+        })
+        failure_df = failure_df.sort_values('نسبة الرسوب %', ascending=False)
+        critical_subjects = failure_df[failure_df['نسبة الرسوب %'] > 50]
+    
+    # Section layout for different categories: unlike st.tabs, which runs every tab's body on each rerun,
+    # only the selected section is computed and rendered
+    at_risk_sections = ["🔴 المعرضون لخطر الهضر المدرسي", "🟡 على الحافة", "⭐ المتميزون", "📊 تحليل الضعف"]
+    active_section = st.radio("القسم", at_risk_sections, horizontal=True, key='at_risk_section', label_visibility='collapsed')
     
-    with tab1:
+    if active_section == at_risk_sections[0]:
         st.markdown("### 🔴 التلاميذ المعرضون لخطر الهضر المدرسي (معدل < 9)")
         if len(at_risk) > 0:
             st.warning(f"⚠️ يوجد **{len(at_risk)}** تلاميذ بحاجة إلى تدخل عاجل!")
             
-            for idx, row in at_risk.iterrows():
-                with st.expander(f"📋 {row['اسم التلميذ']} - المعدل: {row['المعدل']:.2f}"):
+            # Every student's subjects ranked weakest first, in one sort over the grade matrix
+            at_risk_ranked = ranked_grades(at_risk[analysis_subject_cols].to_numpy(dtype=np.float64, na_value=np.nan),
+                                           analysis_subject_cols)
+            for name, current_avg, sorted_subjects in zip(at_risk['اسم التلميذ'], at_risk['المعدل'], at_risk_ranked):
+                with st.expander(f"📋 {name} - المعدل: {current_avg:.2f}"):
                     # Find weakest subjects
-                    subject_scores = {}
-                    for col in subject_columns:
-                        if col != 'المعدل' and col in df_filtered.columns and pd.notna(row.get(col)):
-                            subject_scores[col] = row[col]
-                    
-                    if subject_scores:
-                        sorted_subjects = sorted(subject_scores.items(), key=lambda x: x[1])
-                        
+                    if sorted_subjects:
                         st.markdown("**🔻 أضعف المواد (تحتاج تدخلاً):**")
-                        for subj, score in sorted_subjects[:3]:
-                            color = "red" if score < 10 else "green"
-                            gap = 10 - score
-                            st.markdown(f"- **{subj}**: :red[{score:.2f}] (يحتاج +{gap:.2f} للنجاح)")
+                        st.markdown('\n'.join(f"- **{subj}**: :red[{score:.2f}] (يحتاج +{10 - score:.2f} للنجاح)"
+                                               for subj, score in sorted_subjects[:3]))
                         
                         # Calculate what's needed
-                        current_avg = row['المعدل']
-                        points_needed = (10 - current_avg) * len(subject_scores)
+                        points_needed = (10 - current_avg) * len(sorted_subjects)
                         st.info(f"💡 يحتاج إلى رفع مجموع نقاطه بـ **{points_needed:.1f}** نقطة للوصول للمعدل 10")
         else:
             st.success("✅ لا يوجد تلاميذ معرضون لخطر الهضر المدرسي!")
     
-    with tab2:
+    elif active_section == at_risk_sections[1]:
         st.markdown("### 🟡 التلاميذ على الحافة (معدل 9-10)")
         if len(borderline_low) > 0:
             st.info(f"📊 يوجد **{len(borderline_low)}** تلاميذ قريبون جداً من خط النجاح")
             
-            for idx, row in borderline_low.iterrows():
-                with st.expander(f"📋 {row['اسم التلميذ']} - المعدل: {row['المعدل']:.2f}"):
-                    subject_scores = {}
-                    for col in subject_columns:
-                        if col != 'المعدل' and col in df_filtered.columns and pd.notna(row.get(col)):
-                            subject_scores[col] = row[col]
-                    
-                    if subject_scores:
-                        sorted_subjects = sorted(subject_scores.items(), key=lambda x: x[1])
+            borderline_low_ranked = ranked_grades(
+                borderline_low[analysis_subject_cols].to_numpy(dtype=np.float64, na_value=np.nan), analysis_subject_cols)
+            for name, current_avg, sorted_subjects in zip(borderline_low['اسم التلميذ'], borderline_low['المعدل'], borderline_low_ranked):
+                with st.expander(f"📋 {name} - المعدل: {current_avg:.2f}"):
+                    if sorted_subjects:
                         failing_subjects = [(s, sc) for s, sc in sorted_subjects if sc < 10]
                         
                         if failing_subjects:
                             st.markdown("**🎯 المواد التي تسحب المعدل للأسفل:**")
-                            for subj, score in failing_subjects[:3]:
-                                gap = 10 - score
-                                st.markdown(f"- **{subj}**: :red[{score:.2f}] (فجوة: {gap:.2f})")
+                            st.markdown('\n'.join(f"- **{subj}**: :red[{score:.2f}] (فجوة: {10 - score:.2f})"
+                                                   for subj, score in failing_subjects[:3]))
                             
                             # Quick win suggestion
                             easiest_fix = failing_subjects[0]
@@ -2610,15 +2669,16 @@ if 'المعدل' in df_filtered.columns:
         if len(borderline_high) > 0:
             st.info(f"📊 يوجد **{len(borderline_high)}** تلاميذ نجحوا بفارق بسيط")
             
-            borderline_high_sorted = borderline_high.sort_values('المعدل')
-            for idx, row in borderline_high_sorted.head(5).iterrows():
-                subject_scores = {col: row[col] for col in subject_columns 
-                                if col != 'المعدل' and col in df_filtered.columns and pd.notna(row.get(col))}
-                if subject_scores:
-                    weakest = min(subject_scores.items(), key=lambda x: x[1])
-                    st.caption(f"• {row['اسم التلميذ']} ({row['المعدل']:.2f}) - أضعف مادة: {weakest[0]} ({weakest[1]:.2f})")
-    
-    with tab3:
+            borderline_high_sorted = borderline_high.sort_values('المعدل').head(5)
+            borderline_high_ranked = ranked_grades(
+                borderline_high_sorted[analysis_subject_cols].to_numpy(dtype=np.float64, na_value=np.nan), analysis_subject_cols)
+            for name, current_avg, sorted_subjects in zip(borderline_high_sorted['اسم التلميذ'], borderline_high_sorted['المعدل'],
+                                                          borderline_high_ranked):
+                if sorted_subjects:
+                    weakest = sorted_subjects[0]
+                    st.caption(f"• {name} ({current_avg:.2f}) - أضعف مادة: {weakest[0]} ({weakest[1]:.2f})")
+    
+    elif active_section == at_risk_sections[2]:
         st.markdown("### ⭐ التلاميذ المتميزون - نموذج التفوق")
         
         if len(excellent) > 0:
@@ -2626,27 +2686,20 @@ if 'المعدل' in df_filtered.columns:
             
             # Top performers
             top_students = excellent.nlargest(5, 'المعدل')
+            top_ranked = ranked_grades(top_students[analysis_subject_cols].to_numpy(dtype=np.float64, na_value=np.nan),
+                                       analysis_subject_cols, descending=True)
             
-            for idx, row in top_students.iterrows():
-                with st.expander(f"🏆 {row['اسم التلميذ']} - المعدل: {row['المعدل']:.2f}", expanded=True):
-                    subject_scores = {}
-                    for col in subject_columns:
-                        if col != 'المعدل' and col in df_filtered.columns and pd.notna(row.get(col)):
-                            subject_scores[col] = row[col]
-                    
-                    if subject_scores:
-                        sorted_subjects = sorted(subject_scores.items(), key=lambda x: x[1], reverse=True)
-                        
+            for name, current_avg, sorted_subjects in zip(top_students['اسم التلميذ'], top_students['المعدل'], top_ranked):
+                with st.expander(f"🏆 {name} - المعدل: {current_avg:.2f}", expanded=True):
+                    if sorted_subjects:
                         col1, col2 = st.columns(2)
                         with col1:
                             st.markdown("**💪 أقوى المواد:**")
-                            for subj, score in sorted_subjects[:3]:
-                                st.markdown(f"- **{subj}**: :green[{score:.2f}]")
+                            st.markdown('\n'.join(f"- **{subj}**: :green[{score:.2f}]" for subj, score in sorted_subjects[:3]))
                         
                         with col2:
                             st.markdown("**📈 مجال للتحسين:**")
-                            for subj, score in sorted_subjects[-2:]:
-                                st.markdown(f"- **{subj}**: {score:.2f}")
+                            st.markdown('\n'.join(f"- **{subj}**: {score:.2f}" for subj, score in sorted_subjects[-2:]))
             
             # Outlier analysis
             if len(outliers_top) > 0:
@@ -2659,29 +2712,10 @@ if 'المعدل' in df_filtered.columns:
         else:
             st.info("لا يوجد تلاميذ متميزون بشكل استثنائي في هذه المجموعة")
     
-    with tab4:
+    else:
         st.markdown("### 📊 تحليل نقاط الضعف حسب المادة")
         
-        # Find subjects where most students struggle
-        subject_failure_analysis = []
-        for col in subject_columns:
-            if col != 'المعدل' and col in df_filtered.columns:
-                subject_data = df_filtered[col].dropna()
-                if len(subject_data) > 0:
-                    failing_count = (subject_data < 10).sum()
-                    failing_pct = (subject_data < 10).mean() * 100
-                    avg_score = subject_data.mean()
-                    subject_failure_analysis.append({
-                        'المادة': col,
-                        'عدد الراسبين': failing_count,
-                        'نسبة الرسوب %': failing_pct,
-                        'المتوسط': avg_score
-                    })
-        
-        if subject_failure_analysis:
-            failure_df = pd.DataFrame(subject_failure_analysis)
-            failure_df = failure_df.sort_values('نسبة الرسوب %', ascending=False)
-            
+        if has_grades.any():
             # Visualization
             fig = px.bar(
                 failure_df,
@@ -2697,31 +2731,26 @@ if 'المعدل' in df_filtered.columns:
             st.plotly_chart(fig, use_container_width=True)
             
             # Critical subjects
-            critical_subjects = failure_df[failure_df['نسبة الرسوب %'] > 50]
             if len(critical_subjects) > 0:
                 st.error(f"⚠️ **مواد حرجة** (أكثر من 50% رسوب): {', '.join(critical_subjects['المادة'].tolist())}")
             
             # Students who fail in multiple subjects
             st.markdown("### 📉 التلاميذ الذين يرسبون في عدة مواد")
             
-            multi_fail_students = []
-            for idx, row in df_analysis.iterrows():
-                failing_subjects = []
-                for col in subject_columns:
-                    if col != 'المعدل' and col in df_filtered.columns and pd.notna(row.get(col)):
-                        if row[col] < 10:
-                            failing_subjects.append(col)
-                
-                if len(failing_subjects) >= 3:
-                    multi_fail_students.append({
-                        'التلميذ': row['اسم التلميذ'],
-                        'المعدل': row['المعدل'],
-                        'عدد المواد الراسب فيها': len(failing_subjects),
-                        'المواد': ', '.join(failing_subjects[:5])
-                    })
+            # df_analysis holds the students with an average, i.e. the graded_rows of the failed-grade matrix;
+            # subject names are only joined for the students failing three or more
+            analysis_failed = failed_grades[graded_rows]
+            student_fail_counts = analysis_failed.sum(axis=1)
+            multi_fail_rows = np.flatnonzero(student_fail_counts >= 3)
+            subject_names = np.asarray(analysis_subject_cols, dtype=object)
+            multi_fail_df = pd.DataFrame({
+                'التلميذ': df_analysis['اسم التلميذ'].to_numpy()[multi_fail_rows],
+                'المعدل': df_analysis['المعدل'].to_numpy()[multi_fail_rows],
+                'عدد المواد الراسب فيها': student_fail_counts[multi_fail_rows],
+                'المواد': [', '.join(subject_names[failed][:5]) for failed in analysis_failed[multi_fail_rows]]
+            })
             
-            if multi_fail_students:
-                multi_fail_df = pd.DataFrame(multi_fail_students)
+            if len(multi_fail_df) > 0:
                 multi_fail_df = multi_fail_df.sort_values('عدد المواد الراسب فيها', ascending=False)
                 
                 st.dataframe(multi_fail_df, use_container_width=True, hide_index=True)
@@ -2742,14 +2771,15 @@ if 'المعدل' in df_filtered.columns:
     if len(borderline_low) > 0:
         recommendations.append(f"🟡 **متابعة دقيقة:** {len(borderline_low)} تلاميذ على حافة الرسوب يحتاجون دعماً مستهدفاً")
     
-    if len(critical_subjects) > 0 if 'critical_subjects' in dir() else False:
+    if len(critical_subjects) > 0:
         recommendations.append(f"📚 **مراجعة طرق التدريس:** المواد الحرجة تحتاج اهتماماً خاصاً")
     
     if len(excellent) > 0:
         recommendations.append(f"⭐ **برنامج تميز:** {len(excellent)} تلاميذ متميزين يمكن إشراكهم في مساعدة زملائهم")
     
-    for rec in recommendations:
-        st.markdown(f"- {rec}")
+    # One bullet list, sent as a single element rather than one st.markdown per recommendation
+    if recommendations:
+        st.markdown('\n'.join(f"- {rec}" for rec in recommendations))
 
 else:
     st.warning("⚠️ لا يوجد عمود 'المعدل' في البيانات")
@@ -2765,26 +2795,41 @@ display_cols = list(dict.fromkeys(display_cols))
 st.dataframe(df_filtered[display_cols], 
              use_container_width=True, height=400)
 
-# Download option
-st.markdown("---")
-
-col_csv, col_ppt = st.columns(2)
-
-with col_csv:
-    # Add UTF-8 BOM for Excel to recognize Arabic characters
-    csv = '\ufeff' + df_filtered.to_csv(index=False)
-    st.download_button(
-        label="📥 تحميل البيانات كـ CSV",
-        data=csv.encode('utf-8'),
-        file_name=f"student_data_statistics.csv",
-        mime="text/csv"
-    )
-
-with col_ppt:
+@st.cache_data(max_entries=8, show_spinner=False)
+def class_row_positions(df):
+    """Row positions of each class's named students, partitioned once per loaded workbook"""
+    named = df['اسم التلميذ'].notna().to_numpy()
+    return {class_name: rows[named[rows]] for class_name, rows in df.groupby('الفصل', observed=True).indices.items()}
+
+@st.cache_data(max_entries=16, ttl=3600, show_spinner=False)
+def build_deck_bytes(df, subject_columns, selected_classes_ppt, combine_all_classes):
+    """Build the whole presentation and return it as .pptx bytes; repeated exports of the same selection hit the cache"""
+    # A selection is a lookup of precomputed row positions rather than a scan of the class column
+    class_rows = class_row_positions(df)
+    prs = new_presentation()
+    if combine_all_classes:
+        # Sorted back into sheet order, as a boolean filter of the frame would keep them
+        selected_rows = [class_rows[class_name] for class_name in selected_classes_ppt if class_name in class_rows]
+        df_ppt = df.iloc[np.sort(np.concatenate(selected_rows or [np.empty(0, dtype=np.intp)]))]
+        generate_slides_for_data(prs, df_ppt, subject_columns, selected_classes_ppt)
+    else:
+        # Slides keep the selection order
+        for class_name in selected_classes_ppt:
+            rows = class_rows.get(class_name)
+            if rows is not None and len(rows) > 0:
+                generate_slides_for_data(prs, df.iloc[rows], subject_columns, [class_name], title_suffix=f"- {class_name}")
+    # Only the serialized bytes outlive this call: the buffer is closed here and the slide tree is freed on return
+    with io.BytesIO() as ppt_buffer:
+        prs.save(ppt_buffer)
+        return ppt_buffer.getvalue()
+
+@st.fragment
+def ppt_export_section(df, subject_columns):
+    """Presentation export controls; interacting with them reruns only this fragment"""
     st.subheader("📊 إنشاء عرض تقديمي")
     
     # Get all available classes
-    all_classes = list(df['الفصل'].unique())
+    all_classes = list(df['الفصل'].cat.categories)
     
     # Option to combine all classes
     combine_all_classes = st.checkbox(
@@ -2804,39 +2849,16 @@ with col_ppt:
     if len(selected_classes_ppt) == 0:
         st.warning("⚠️ الرجاء اختيار فصل واحد على الأقل")
     
-    # Filter data for presentation based on selected classes
-    df_ppt = df[df['الفصل'].isin(selected_classes_ppt)].copy()
-    df_ppt = df_ppt.dropna(subset=['اسم التلميذ'])
-    
     # Show summary of selection
     if st.button("📊 إنشاء العرض التقديمي (PPTX)", disabled=len(selected_classes_ppt) == 0):
         with st.spinner("جاري إنشاء العرض التقديمي..."):
             try:
-                # Initialize presentation
-                prs = Presentation()
-                
-                # Set 16:9 widescreen layout
-                prs.slide_width = Inches(13.333)
-                prs.slide_height = Inches(7.5)
-                
-                # Create slides based on selection
-                if combine_all_classes:
-                    generate_slides_for_data(prs, df_ppt, subject_columns, selected_classes_ppt)
-                else:
-                    for class_name in selected_classes_ppt:
-                        class_df = df_ppt[df_ppt['الفصل'] == class_name]
-                        if len(class_df) > 0:
-                            generate_slides_for_data(prs, class_df, subject_columns, [class_name], title_suffix=f"- {class_name}")
-                
-                # Save to buffer
-                ppt_buffer = io.BytesIO()
-                prs.save(ppt_buffer)
-                ppt_buffer.seek(0)
+                deck_bytes = build_deck_bytes(df, tuple(subject_columns), tuple(selected_classes_ppt), combine_all_classes)
                 
                 st.success("✅ تم إنشاء العرض التقديمي بنجاح!")
                 st.download_button(
                     label="📥 تحميل العرض التقديمي",
-                    data=ppt_buffer,
+                    data=deck_bytes,
                     file_name="student_analysis_report.pptx",
                     mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
                 )
@@ -2844,4 +2866,22 @@ with col_ppt:
                 st.error(f"❌ حدث خطأ أثناء إنشاء العرض التقديمي: {str(e)}")
                 import traceback
                 st.code(traceback.format_exc())
-    
+
+# Download option
+st.markdown("---")
+
+col_csv, col_ppt = st.columns(2)
+
+with col_csv:
+    # utf-8-sig adds the BOM Excel needs to recognize Arabic characters; pandas encodes straight into the buffer
+    csv_buffer = io.BytesIO()
+    df_filtered.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
+    st.download_button(
+        label="📥 تحميل البيانات كـ CSV",
+        data=csv_buffer.getvalue(),
+        file_name=f"student_data_statistics.csv",
+        mime="text/csv"
+    )
+
+with col_ppt:
+    ppt_export_section(df, subject_columns)
@@ -1,17 +1,20 @@
 import pandas as pd
 
-# Read with no header first to find where the actual data starts
+# Read with no header first to find where the actual data starts; this is the only pass over the workbook
 df = pd.read_excel('الثانوية التأهيلية صلاح الدين الايوبي_الثالثة إعدادي مسار دولي.xlsx', sheet_name='3APIC-1', header=None)
 
-# Find the row with actual headers
-for i, row in df.iterrows():
-    if 'اسم' in str(row.values):
-        print(f"Header row at index {i}:")
-        print(row)
-        print("\nData after this row:")
-        data_df = pd.read_excel('الثانوية التأهيلية صلاح الدين الايوبي_الثالثة إعدادي مسار دولي.xlsx', sheet_name='3APIC-1', header=i)
-        print(data_df.head(10))
-        print("\nColumns:", data_df.columns.tolist())
-        print("\nData types:")
-        print(data_df.dtypes)
-        break
+# Find the row with actual headers with one vectorized string search instead of iterrows
+header_mask = df.astype(str).apply(lambda s: s.str.contains('اسم', regex=False)).any(axis=1)
+if header_mask.any():
+    i = header_mask.idxmax()
+    row = df.iloc[i]
+    print(f"Header row at index {i}:")
+    print(row)
+    print("\nData after this row:")
+    # Rebuild the table from the frame already in memory rather than re-reading the sheet with header=i
+    data_df = df.iloc[i + 1:].reset_index(drop=True).infer_objects()
+    data_df.columns = row.values
+    print(data_df.head(10))
+    print("\nColumns:", data_df.columns.tolist())
+    print("\nData types:")
+    print(data_df.dtypes)